@@ -15,29 +15,35 @@
 
 import re
 import json
-import sched
+import itertools
 import shlex
 import tempfile
 import time
 import threading
 import os
+import sys
 import base64
 
 import sh
 import argh
-import yaml
-import requests
-from watchdog import events
-from watchdog import observers
 from path import path
-from time import sleep
-
-from cloudify_cli import env as cli_env
 
 from docl import constants
 from docl import resources
 from docl import install_rpm_server
 from docl import files
+from docl import readiness
+from docl import registry
+from docl import pool as standby_pool
+from docl import snapshots
+from docl import startup
+from docl import docker_api
+from docl import compression as image_compression
+from docl import layers as image_layers
+from docl import metrics
+from docl import services
+from docl import sync as source_sync
+from docl import watching
 from docl.configuration import configuration
 from docl.work import work
 from docl.subprocess import docker
@@ -46,8 +52,10 @@ from docl.subprocess import ssh as _ssh
 from docl.subprocess import ssh_keygen
 from docl.subprocess import ssh_keyscan
 from docl.subprocess import cfy
-from docl.subprocess import gzip
+from docl.subprocess import docker_events
+from docl.subprocess import spawn_detached
 from docl.logs import logger
+from docl.tracing import span
 
 app = argh.EntryPoint('docl')
 command = app
@@ -67,10 +75,16 @@ command = app
     help="URL for the checksum of the provided Manager image file. Used to "
          "prevent downloading the last image downloaded with `docl pull-image`"
          ", again.")
+@argh.arg(
+    '--docker-backend', choices=constants.DOCKER_BACKENDS,
+    help="How docl talks to the docker daemon: `api` uses pooled Engine API "
+         "connections (unix:// and tcp:// hosts) and falls back to the "
+         "docker CLI for everything else, `cli` always forks the docker CLI.")
 def init(manager_image_url=constants.MANAGER_IMAGE_URL,
          manager_image_docker_tag=constants.MANAGER_IMAGE_DOCKER_TAG,
          manager_image_commit_sha_url=constants.MANAGER_IMAGE_COMMIT_SHA_URL,
          docker_host=constants.DOCKER_HOST,
+         docker_backend=constants.DOCKER_BACKEND,
          ssh_key_path=constants.SSH_KEY,
          clean_image_docker_tag=constants.CLEAN_IMAGE_DOCKER_TAG,
          source_root=constants.SOURCE_ROOT,
@@ -84,6 +98,7 @@ def init(manager_image_url=constants.MANAGER_IMAGE_URL,
         )
     configuration.save(
         docker_host=docker_host,
+        docker_backend=docker_backend,
         ssh_key_path=ssh_key_path.abspath(),
         clean_image_docker_tag=clean_image_docker_tag,
         manager_image_docker_tag=manager_image_docker_tag,
@@ -144,15 +159,17 @@ def bootstrap(inputs=None, label=None, details_path=None, tag=None,
 def _install_manager(container_id, container_ip, config_path, rpm_url=None):
     rpm_url = rpm_url or install_rpm_server.get_rpm_url()
     logger.info('Downloading install RPM from: {0}'.format(rpm_url))
-    exc(
-        'curl {0} -o {1}'.format(rpm_url, constants.INSTALL_RPM_PATH),
-        container_id
-    )
+    with span('download install RPM'):
+        exc(
+            'curl {0} -o {1}'.format(rpm_url, constants.INSTALL_RPM_PATH),
+            container_id
+        )
     logger.info('Installing RPM...')
-    exc(
-        'yum install -y {0}'.format(constants.INSTALL_RPM_PATH),
-        container_id
-    )
+    with span('install RPM'):
+        exc(
+            'yum install -y {0}'.format(constants.INSTALL_RPM_PATH),
+            container_id
+        )
     logger.info('Removing install RPM...')
     exc('rm {0}'.format(constants.INSTALL_RPM_PATH))
     logger.info('Copying configuration...')
@@ -160,38 +177,231 @@ def _install_manager(container_id, container_ip, config_path, rpm_url=None):
     logger.info('Installing Cloudify Manager...')
     install_cmd = 'cfy_manager install --private-ip {0} --public-ip ' \
                   '{0}'.format(container_ip)
-    exc(install_cmd, container_id)
+    with span('install manager'):
+        exc(install_cmd, container_id)
+
+
+@command
+@argh.arg('action', choices=('fill', 'ls', 'drain'))
+@argh.arg('-s', '--size', type=int,
+          help='Number of standby containers to keep (defaults to the '
+               '`pool_size` configuration value).')
+def pool(action, size=None, mount=False, tag=None):
+    """Manage the warm pool of standby manager containers"""
+    docker_tag = tag or configuration.manager_image_docker_tag
+    if action == 'ls':
+        # without the image, no standby container is ready to be claimed
+        try:
+            image_id = _image_id(docker_tag)
+        except sh.ErrorReturnCode:
+            image_id = None
+        for container in standby_pool.standby():
+            state = 'ready' if container.get('image_id') == image_id \
+                else 'stale'
+            yield '{} {} {} {}'.format(container['id'][:12],
+                                       container['ip'],
+                                       container['image'], state)
+    elif action == 'drain':
+        for container in standby_pool.standby():
+            _remove_standby(container)
+    else:
+        _fill_pool(docker_tag=docker_tag,
+                   size=configuration.pool_size if size is None else size,
+                   mount=mount)
+
+
+def _fill_pool(docker_tag, size, mount):
+    with standby_pool.fill_lock() as locked:
+        if not locked:
+            logger.info('The pool is already being filled')
+            return
+        image_id = _image_id(docker_tag)
+        for container in standby_pool.stale(docker_tag, image_id):
+            logger.info('Evicting stale standby container {}'
+                        .format(container['id']))
+            _remove_standby(container)
+        volumes = _build_volumes() if mount else None
+        missing = size - len(standby_pool.standby(docker_tag,
+                                                  list(volumes or [])))
+        for _ in range(missing):
+            container_id, container_ip = _run_container(
+                docker_tag=docker_tag,
+                volume=volumes,
+                standby=True)
+            _ssh_setup(container_id, container_ip)
+            _update_container(container_id, container_ip)
+            logger.info('Standby container {} is ready'.format(container_id))
+
+
+def _remove_standby(container):
+    try:
+        quiet_docker.rm('-f', container['id'])
+    except sh.ErrorReturnCode as e:
+        logger.warning('Failed removing container {}: {}'
+                       .format(container['id'], e))
+    work.registry.remove(container['id'])
+
+
+@command
+def snapshot(name, container_id=None):
+    """Save the state of a manager container to restore it later"""
+    container_id = work.container_id(container_id)
+    container = work.registry.get(container_id)
+    if not container or not container.get('run_args'):
+        raise argh.CommandError('Container {} was not started by this '
+                                'version of docl and cannot be snapshotted'
+                                .format(container_id))
+    image = snapshots.image_tag(name)
+    logger.info('Saving container {} to snapshot {}'
+                .format(container_id, name))
+    quiet_docker.commit(container_id, image)
+    # only the committed layer is unique to the snapshot, the layers below
+    # it are shared with the manager image
+    size = int(str(quiet_docker.history(
+        '--human=false', '--format={{.Size}}', image)).split()[0])
+    work.snapshots.add(name, image=image, size=size, container=container)
+    for evicted in work.snapshots.over_budget(
+            configuration.snapshot_disk_budget, keep=name):
+        logger.info('Evicting snapshot {} to stay within the disk budget'
+                    .format(evicted['name']))
+        _remove_snapshot(evicted)
+
+
+@command
+def restore(name, keep_container=False, details_path=None):
+    """Recreate the container a snapshot was taken from"""
+    snapshot = work.snapshots.get(name)
+    if not snapshot:
+        raise argh.CommandError('No such snapshot: {}'.format(name))
+    if not keep_container and work.registry.get(snapshot['container_id']):
+        logger.info('Removing container {}'.format(snapshot['container_id']))
+        quiet_docker.rm('-f', snapshot['container_id'])
+        work.registry.remove(snapshot['container_id'])
+    run_args = snapshot['run_args']
+    if keep_container:
+        # the kept container still holds the name and the published host
+        # ports; the restored one publishes its ports on random host ports
+        run_args = [_random_host_port(a) if a.startswith('--publish=')
+                    else a for a in run_args
+                    if not a.startswith('--name=')]
+    logger.info('Restoring snapshot {}'.format(name))
+    labels = ['{}={}'.format(k, v) for k, v in snapshot['labels'].items()
+              if '{}={}'.format(k, v) != constants.DOCL_CONTAINER_LABEL]
+    container_id, container_ip = _run_container(
+        docker_tag=snapshot['image'],
+        volume=snapshot['mounts'],
+        label=labels,
+        name=None if keep_container else snapshot['container_name'],
+        details_path=details_path,
+        run_args=run_args)
+    work.snapshots.touch(name, container_id=container_id)
+    _ssh_setup(container_id, container_ip)
+    credentials = _get_manager_credentials(container_id)
+    readiness.wait([readiness.CallProbe(_get_credentials_and_use_manager,
+                                        credentials, container_ip)])
+    _update_container(container_id, container_ip)
+
+
+def _random_host_port(publish_arg):
+    """--publish=[IP:][HOST_PORT:]PORT without the host port"""
+    parts = publish_arg[len('--publish='):].split(':')
+    if len(parts) == 3:
+        return '--publish={}::{}'.format(parts[0], parts[2])
+    return '--publish={}'.format(parts[-1])
+
+
+@command
+def list_snapshots():
+    for snapshot in reversed(work.snapshots.all()):
+        yield '{} {:.1f}MB {}'.format(
+            snapshot['name'], snapshot['size'] / 1024.0 ** 2,
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(snapshot['last_used'])))
+
+
+@command
+def remove_snapshot(name):
+    snapshot = work.snapshots.get(name)
+    if not snapshot:
+        raise argh.CommandError('No such snapshot: {}'.format(name))
+    _remove_snapshot(snapshot)
+
+
+def _remove_snapshot(snapshot):
+    try:
+        quiet_docker.rmi(snapshot['image'])
+    except sh.ErrorReturnCode as e:
+        logger.warning('Failed removing snapshot image {}: {}'
+                       .format(snapshot['image'], e))
+    work.snapshots.remove(snapshot['name'])
 
 
 @command
 def restart_container(container_id=None):
-    container_id = container_id or work.last_container_id
+    container_id = work.container_id(container_id)
     quiet_docker.restart(container_id, time=0)
 
 
 @command
+@argh.arg('--compression', help='Compression of the output file: gzip, pigz '
+                                '(multi-threaded gzip) or zstd. Defaults '
+                                'to the configured compression.')
+@argh.arg('--compression-level', type=int,
+          help='Defaults to the configured level')
+@argh.arg('--compression-threads', type=int,
+          help='0 uses all cores. Defaults to the configured thread count')
+@argh.arg('--layers-dir', help='Also save the image layer by layer to this '
+                               'directory, for `docl pull-image --layers`')
 def save_image(container_id=None,
                tag=None,
                output_file=None,
-               skip_agent_prepare=False):
-    container_id = container_id or work.last_container_id
+               skip_agent_prepare=False,
+               compression=None,
+               compression_level=None,
+               compression_threads=None,
+               layers_dir=None):
+    container_id = work.container_id(container_id)
     docker_tag = tag or configuration.manager_image_docker_tag
     logger.info('Preparing manager container before saving as docker image')
-    _run_container_preparation_scripts(container_id, skip_agent_prepare)
+    with span('prepare container'):
+        _run_container_preparation_scripts(container_id, skip_agent_prepare)
     logger.info('Saving manager container to image {}'.format(docker_tag))
-    quiet_docker.stop(container_id)
-    quiet_docker.commit(container_id, docker_tag)
+    with span('commit image'):
+        quiet_docker.stop(container_id)
+        quiet_docker.commit(container_id, docker_tag)
     logger.info("Removing container. Run 'docl run' to start it again")
     quiet_docker.rm('-f', container_id)
+    work.registry.remove(container_id)
+    for container in standby_pool.stale(docker_tag, _image_id(docker_tag)):
+        logger.info('Evicting stale standby container {}'
+                    .format(container['id']))
+        _remove_standby(container)
+    compression = compression or configuration.compression
+    if compression_level is None:
+        compression_level = configuration.compression_level
+    if compression_threads is None:
+        compression_threads = configuration.compression_threads
     if output_file:
         logger.info('Saving manager image to {}. This may take a while'
                     .format(output_file))
-        gzip(quiet_docker.save(docker_tag,
-                               _piped=True,
-                               _tty_out=False,
-                               _out_bufsize=constants.BUFFER_SIZE),
-             _in_bufsize=constants.BUFFER_SIZE,
-             _out=output_file)
+        with span('save image file'):
+            compress = image_compression.compressor(
+                compression,
+                level=compression_level,
+                threads=compression_threads)
+            compress(quiet_docker.save(docker_tag,
+                                       _piped=True,
+                                       _tty_out=False,
+                                       _out_bufsize=constants.BUFFER_SIZE),
+                     _in_bufsize=constants.BUFFER_SIZE,
+                     _out=output_file)
+    if layers_dir:
+        logger.info('Saving manager image layers to {}. This may take a '
+                    'while'.format(layers_dir))
+        with span('save image layers'):
+            image_layers.save(docker_tag, layers_dir, compression,
+                              level=compression_level,
+                              threads=compression_threads)
 
 
 def _run_container_preparation_scripts(container_id, skip_agent_prepare):
@@ -210,33 +420,228 @@ def _run_container_preparation_scripts(container_id, skip_agent_prepare):
 
 
 @command
-def pull_image(no_progress=False):
+@argh.arg('--stream', help='Load the image into docker while it downloads '
+                           'instead of after the download completed.')
+@argh.arg('--no-cache', help='With --stream, do not keep a copy of the '
+                             'downloaded image on disk.')
+@argh.arg('--layers', help='Pull the layered image at the configured '
+                           '`manager_image_layers_url`, downloading only '
+                           'the layers missing from the docker daemon.')
+def pull_image(no_progress=False,
+               connections=constants.DOWNLOAD_CONNECTIONS,
+               stream=False, no_cache=False, layers=False):
     # try contacting the docker daemon first, to break early if it's not
     # reachable - before the long download
     quiet_docker.version()
 
-    online_sha1 = requests.get(
-        configuration.manager_image_commit_sha_url).text.strip()
-    local_sha1 = work.last_pulled_image_commit_sha1
-    if online_sha1 == local_sha1:
-        logger.info('Current image is the latest image. It is based on the '
-                    'following commit in the manager blueprints repo: {}'
-                    .format(local_sha1))
+    if layers:
+        _pull_image_layers(no_progress, connections)
+        return
+
+    url = configuration.manager_image_url
+    key, etag = _image_cache_key(url)
+    if key == work.last_pulled_image_commit_sha1:
+        logger.info('Current image is the latest image ({})'.format(key))
+        return
+    cache = work.image_cache
+    image_path = cache.file_path(key)
+    if cache.get(key):
+        logger.info('Loading cached manager image {} into docker (may take '
+                    'a while)'.format(key))
+        cache.touch(key)
+        with span('load image'):
+            _load_image_file(image_path)
+    elif stream:
+        logger.info('Streaming manager image from {} into docker'
+                    .format(url))
+        with span('stream image'):
+            _stream_image(url=url,
+                          cache_path=None if no_cache else image_path,
+                          no_progress=no_progress)
+        if not no_cache:
+            cache.add(key, url, etag)
+    else:
+        logger.info('Download manager image from {} to {}'
+                    .format(url, image_path))
+        # an interrupted download of the same image is resumed
+        with span('download image'):
+            files.download(url=url,
+                           output_path=image_path,
+                           no_progress=no_progress,
+                           connections=connections)
+        cache.add(key, url, etag)
+        logger.info('Loading image into docker (may take a while)')
+        with span('load image'):
+            _load_image_file(image_path)
+    work.last_pulled_image_commit_sha1 = key
+    for evicted in cache.over_budget(configuration.image_cache_disk_budget,
+                                     keep=key):
+        logger.info('Evicting cached image {} to stay within the disk budget'
+                    .format(evicted['key']))
+        cache.remove(evicted['key'])
+
+
+def _pull_image_layers(no_progress, connections):
+    url = configuration.manager_image_layers_url
+    if not url:
+        raise argh.CommandError('Pulling layers requires a '
+                                'manager_image_layers_url configuration value')
+    tag = configuration.manager_image_docker_tag
+    try:
+        current_image_id = _image_id(tag)
+    except sh.ErrorReturnCode:
+        current_image_id = None
+    logger.info('Pulling manager image layers from {}'.format(url))
+    with span('pull image layers'):
+        image_id = image_layers.pull(url, tag,
+                                     download_dir=work.dir / 'layers',
+                                     no_progress=no_progress,
+                                     connections=connections,
+                                     current_image_id=current_image_id)
+    if not image_id:
+        logger.info('Current image is the latest image ({})'
+                    .format(current_image_id))
         return
-    logger.info('Download manager image from {} to {}'
-                .format(configuration.manager_image_url,
-                        work.pulled_image_path))
-    if os.path.exists(work.pulled_image_path):
-        os.remove(work.pulled_image_path)
-    files.download(url=configuration.manager_image_url,
-                   output_path=work.pulled_image_path,
-                   no_progress=no_progress)
-    logger.info('Loading image into docker (may take a while)')
-    quiet_docker.load(gzip('-dc', work.pulled_image_path,
-                           _piped=True,
-                           _out_bufsize=constants.BUFFER_SIZE),
+    work.last_pulled_image_commit_sha1 = image_id
+
+
+def _image_cache_key(url):
+    """The key of the image currently published at `url` and its ETag:
+    the commit sha1 it was built from, or, without a commit sha1 URL, a
+    hash of the URL and ETag"""
+    import requests
+    commit_sha_url = configuration.manager_image_commit_sha_url
+    if commit_sha_url:
+        return requests.get(commit_sha_url).text.strip(), None
+    etag = requests.head(url, allow_redirects=True).headers.get('ETag')
+    if not etag:
+        raise argh.CommandError(
+            'Cannot tell which image {} holds: no manager image commit sha1 '
+            'URL is configured and the server sends no ETag'.format(url))
+    return work.image_cache.url_key(url, etag), etag
+
+
+def _load_image_file(image_path):
+    decompress = image_compression.decompressor(
+        image_compression.detect_file(image_path))
+    quiet_docker.load(decompress(image_path,
+                                 _piped=True,
+                                 _out_bufsize=constants.BUFFER_SIZE),
                       _in_bufsize=constants.BUFFER_SIZE)
-    work.last_pulled_image_commit_sha1 = online_sha1
+
+
+def _stream_image(url, cache_path, no_progress):
+    """Pipe the download through its decompressor into docker load.
+
+    The download runs in its own thread and hands chunks over through a
+    bounded queue, so memory use stays flat while decompression and loading
+    keep up with the network.
+    """
+    try:
+        import Queue as queue
+    except ImportError:
+        import queue
+    tag = configuration.manager_image_docker_tag
+    try:
+        previous_image_id = _image_id(tag)
+    except sh.ErrorReturnCode:
+        previous_image_id = None
+    chunks = queue.Queue(maxsize=constants.STREAM_QUEUE_SIZE)
+    stopped = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def download():
+        try:
+            for chunk in files.iter_download(url, no_progress=no_progress,
+                                             cache_path=cache_path):
+                if not put(chunk):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # sh stops reading stdin at None
+            put(None)
+    downloader = threading.Thread(target=download)
+    downloader.daemon = True
+    downloader.start()
+    try:
+        # the first chunk tells which decompressor the stream needs
+        first = chunks.get()
+        if first is None:
+            downloader.join()
+            raise errors[0] if errors else argh.CommandError(
+                'Empty manager image at {}'.format(url))
+        decompress = image_compression.decompressor(
+            image_compression.detect(first))
+        stream = itertools.chain([first], iter(chunks.get, None))
+        quiet_docker.load(decompress(_in=stream,
+                                     _piped=True,
+                                     _out_bufsize=constants.BUFFER_SIZE),
+                          _in_bufsize=constants.BUFFER_SIZE)
+        downloader.join()
+    except BaseException:
+        stopped.set()
+        _remove_partial_image(tag, previous_image_id)
+        # a failed download also fails decompression; report the cause
+        if errors:
+            raise errors[0]
+        raise
+    if errors:
+        _remove_partial_image(tag, previous_image_id)
+        raise errors[0]
+
+
+def _remove_partial_image(tag, previous_image_id):
+    # docker only tags an image once all of its layers loaded; layers of
+    # an interrupted load are released by the daemon. An image that did get
+    # tagged from a stream that failed afterwards is removed.
+    try:
+        image_id = _image_id(tag)
+    except sh.ErrorReturnCode:
+        return
+    if image_id != previous_image_id:
+        logger.warning('Removing image {} loaded from a failed download'
+                       .format(tag))
+        quiet_docker.rmi('-f', image_id)
+
+
+@command
+@argh.arg('action', choices=('ls', 'prune'))
+@argh.arg('-b', '--budget', type=int,
+          help='Evict least recently used images until the cache fits this '
+               'many MB (defaults to the `image_cache_disk_budget` '
+               'configuration value).')
+def image_cache(action, budget=None):
+    """Manage the cache of downloaded manager images"""
+    cache = work.image_cache
+    if action == 'ls':
+        loaded = work.last_pulled_image_commit_sha1
+        for image in reversed(cache.all()):
+            yield '{} {:.1f}MB {}{}'.format(
+                image['key'], image['size'] / 1024.0 ** 2,
+                time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(image['last_used'])),
+                ' loaded' if image['key'] == loaded else '')
+    else:
+        if budget is None:
+            budget = configuration.image_cache_disk_budget
+        else:
+            budget *= 1024 ** 2
+        for image in cache.over_budget(budget):
+            logger.info('Removing cached image {}'.format(image['key']))
+            cache.remove(image['key'])
+        for file_path in cache.orphans():
+            logger.info('Removing {}'.format(file_path))
+            file_path.remove()
 
 
 @command
@@ -246,37 +651,238 @@ def remove_image(tag=None):
     quiet_docker.rmi(tag)
 
 
+@command
+@argh.arg('--size', help='Size in MB of the synthetic tar stream')
+@argh.arg('--codecs', nargs='+', help='Codecs to compare')
+@argh.arg('--level', type=int, help='Defaults to the configured level')
+@argh.arg('--threads', type=int,
+          help='Defaults to the configured thread count')
+def benchmark_compression(size=256, codecs=image_compression.CODECS,
+                          level=None, threads=None):
+    """Compare image compression throughput and ratio"""
+    if level is None:
+        level = configuration.compression_level
+    if threads is None:
+        threads = configuration.compression_threads
+    data = image_compression.synthetic_tar(size * 1024 ** 2)
+    yield '{:<6}  {:>6}  {:>14}  {:>16}'.format(
+        'codec', 'ratio', 'compress MB/s', 'decompress MB/s')
+    for codec, ratio, compress_rate, decompress_rate in \
+            image_compression.benchmark(data, codecs, level, threads):
+        yield '{:<6}  {:>6.2f}  {:>14.1f}  {:>16.1f}'.format(
+            codec, ratio, compress_rate, decompress_rate)
+
+
+@command
+@argh.arg('--commands', nargs='+',
+          help='Commands to measure (defaults to all of them)')
+@argh.arg('--max-ms', type=int,
+          help='Fail if a command takes longer than this to start')
+def benchmark_startup(commands=None, runs=3,
+                      max_ms=constants.STARTUP_BUDGET_MS):
+    """Measure CLI startup time per command and fail on regressions"""
+    commands = commands or sorted(
+        getattr(f, 'argh_name', f.__name__.replace('_', '-'))
+        for f in app.commands)
+    regressions = []
+    yield '{:<24}  {:>8}  {}'.format('command', 'ms', 'heavy imports')
+    for command_name in commands:
+        elapsed, heavy = startup.measure(command_name, runs)
+        yield '{:<24}  {:>8.1f}  {}'.format(command_name, elapsed * 1000,
+                                            ', '.join(heavy) or '-')
+        if elapsed * 1000 > max_ms or heavy:
+            regressions.append(command_name)
+    if regressions:
+        raise argh.CommandError(
+            'Startup regressed for: {}'.format(', '.join(regressions)))
+
+
+_profile_lock = threading.Lock()
+_known_hosts_lock = threading.Lock()
+
+
 @command
 @argh.arg('-l', '--label', action='append')
 @argh.arg('-n', '--name')
-def run(mount=False, label=None, name=None, details_path=None, tag=None):
+@argh.arg('-c', '--count', type=int,
+          help='Number of manager containers to start. With a --name, '
+               'containers are named NAME-0 ... NAME-<COUNT-1>.')
+@argh.arg('-w', '--workers', type=int,
+          help='Maximum number of containers started concurrently.')
+@argh.arg('--no-pool', help='Always start a new container instead of '
+                            'claiming a standby container from the pool.')
+@argh.arg('-s', '--sync', help='Copy the sources into the container instead '
+                               'of mounting them, for remote docker hosts. '
+                               'Use "docl sync" or "docl watch" to update '
+                               'them.')
+def run(mount=False, label=None, name=None, details_path=None, tag=None,
+        count=1, workers=constants.FLEET_WORKERS, no_pool=False, sync=False):
+    if mount and sync:
+        raise argh.CommandError('--mount and --sync are mutually exclusive')
+    if count < 1:
+        raise argh.CommandError('--count must be at least 1')
+    if workers < 1:
+        raise argh.CommandError('--workers must be at least 1')
     docker_tag = tag or configuration.manager_image_docker_tag
     volumes = _build_volumes() if mount else None
-    container_id, container_ip = _run_container(docker_tag=docker_tag,
-                                                volume=volumes,
-                                                label=label,
-                                                name=name,
-                                                details_path=details_path)
+    # docker can't add the labels to a standby container once started
+    if count == 1 and not no_pool and not label:
+        claimed = _claim_standby(docker_tag=docker_tag,
+                                 volumes=volumes,
+                                 label=label,
+                                 name=name,
+                                 details_path=details_path,
+                                 sync=sync)
+        if configuration.pool_size:
+            _refill_pool_in_background(mount=mount, tag=tag)
+        if claimed:
+            return
+    if count == 1:
+        _start_manager(docker_tag=docker_tag,
+                       volumes=volumes,
+                       label=label,
+                       name=name,
+                       details_path=details_path,
+                       sync=sync)
+        return
+    _start_fleet(count=count,
+                 workers=workers,
+                 docker_tag=docker_tag,
+                 volumes=volumes,
+                 label=label,
+                 name=name,
+                 details_path=details_path,
+                 sync=sync)
+
+
+def _start_manager(docker_tag, volumes, label, name, details_path=None,
+                   sync=False):
+    with span('run container'):
+        container_id, container_ip = _run_container(
+            docker_tag=docker_tag,
+            volume=volumes,
+            label=label,
+            name=name,
+            details_path=details_path)
     _ssh_setup(container_id, container_ip)
 
-    credentials = _get_manager_credentials(container_id)
-    _retry(_get_credentials_and_use_manager, credentials, container_ip)
+    with span('use manager profile'):
+        credentials = _get_manager_credentials(container_id)
+        with _profile_lock:
+            readiness.wait([readiness.CallProbe(
+                _get_credentials_and_use_manager, credentials,
+                container_ip)])
     _update_container(container_id, container_ip)
+    if sync:
+        _sync_sources(container_id)
+    return container_id, container_ip
 
 
-def _retry(func, *args, **kwargs):
-    for _ in range(300):
+def _claim_standby(docker_tag, volumes, label, name, details_path,
+                   sync=False):
+    mounts = list(volumes or [])
+    if not standby_pool.standby(docker_tag, mounts):
+        return None
+    label = [constants.DOCL_CONTAINER_LABEL] + list(label or [])
+    container = standby_pool.claim(docker_tag=docker_tag,
+                                   mounts=mounts,
+                                   image_id=_image_id(docker_tag),
+                                   labels=registry.labels_dict(label),
+                                   name=name)
+    if not container:
+        return None
+    container_id, container_ip = container['id'], container['ip']
+    logger.info('Claimed standby container {} from the pool'
+                .format(container_id))
+    if name:
+        quiet_docker.rename(container_id, name)
+    credentials = _get_manager_credentials(container_id)
+    with _profile_lock:
+        readiness.wait([readiness.CallProbe(_get_credentials_and_use_manager,
+                                            credentials, container_ip)])
+    if sync:
+        _sync_sources(container_id)
+    if details_path:
+        _write_container_details(container_id=container_id,
+                                 container_ip=container_ip,
+                                 details_path=details_path)
+    return container_id, container_ip
+
+
+def _refill_pool_in_background(mount, tag):
+    args = [sys.executable, '-m', 'docl.main', 'pool', 'fill']
+    if mount:
+        args.append('--mount')
+    if tag:
+        args += ['--tag', tag]
+    # filling the pool takes minutes; it should not occupy a daemon
+    env = dict(os.environ)
+    env[constants.DOCL_NO_DAEMON_ENV_VAR] = '1'
+    spawn_detached(args, log_path=work.dir / 'pool.log', env=env)
+
+
+def _start_fleet(count, workers, docker_tag, volumes, label, name,
+                 details_path, sync=False):
+    logger.info('Starting {} manager containers ({} at a time)'
+                .format(count, min(count, workers)))
+
+    def start(index):
+        container_name = '{}-{}'.format(name, index) if name else None
         try:
-            func(*args, **kwargs)
-            break
-        except sh.ErrorReturnCode:
-            sleep(0.1)
-    else:
-        raise argh.CommandError()
+            container_id, container_ip = _start_manager(
+                docker_tag=docker_tag,
+                volumes=volumes,
+                label=label,
+                name=container_name,
+                sync=sync)
+        except Exception as e:
+            logger.error('Failed starting manager container {}: {}'
+                         .format(container_name or index, e))
+            return None
+        return {'id': container_id, 'ip': container_ip,
+                'name': container_name}
+
+    from multiprocessing.pool import ThreadPool
+    worker_pool = ThreadPool(min(count, workers))
+    try:
+        results = worker_pool.map(start, range(count))
+    finally:
+        worker_pool.close()
+        worker_pool.join()
+    started = [r for r in results if r]
+    for container in started:
+        logger.info('Container {} started on ip {}'
+                    .format(container['id'], container['ip']))
+    if details_path:
+        import yaml
+        path(details_path).write_text(yaml.safe_dump(started))
+    if len(started) != count:
+        raise argh.CommandError('{} of {} manager containers failed to start'
+                                .format(count - len(started), count))
+
+
+def _sync_sources(container_id, restart=True):
+    """Copy changed sources into a container started with --sync and
+    restart the services using them. Returns whether anything changed."""
+    with span('sync sources'):
+        changed, removed = source_sync.push(
+            container_id,
+            [(src, dst) for src, dst, _ in _source_mappings()],
+            work.sync_hashes)
+    work.registry.update(container_id, sync=True)
+    if not (changed or removed):
+        return False
+    logger.info('Synced {} changed and {} removed files to {}'
+                .format(len(changed), len(removed), container_id))
+    if restart:
+        services.restart(container_id, configuration.services,
+                         order=configuration.service_order)
+    return True
 
 
 def _get_manager_credentials(container_id):
     """ Read the cloudify CLI profile context from the container """
+    import yaml
 
     result = quiet_docker(
         'exec',
@@ -294,6 +900,7 @@ def _get_manager_credentials(container_id):
 
 
 def _get_credentials_and_use_manager(credentials, container_ip):
+    from cloudify_cli import env as cli_env
     cfy.profiles.use(container_ip, skip_credentials_validation=True)
     # Using sh.cfy directly to avoid extra output
     sh.cfy.profiles.set(
@@ -333,7 +940,7 @@ def _update_container(container_id, container_ip):
 
 @command
 def install_docker(version=None, container_id=None):
-    container_id = container_id or work.last_container_id
+    container_id = work.container_id(container_id)
     try:
         quiet_docker('exec', container_id, *'which docker'.split(' '))
         logger.info('Docker already installed on container. Doing nothing')
@@ -401,28 +1008,98 @@ def clean(label=None):
     logger.info('Removing containers')
     for container in containers:
         docker.rm('-f', container)
+        work.registry.remove(container)
+    if not label:
+        # anything else in the registry is already gone
+        work.registry.retain(
+            c.strip() for c in quiet_docker.ps(
+                '-aq', '--no-trunc', '--filter',
+                'label={}'.format(constants.DOCL_CONTAINER_LABEL)).split('\n'))
+
+
+@command
+@argh.arg('-l', '--label', action='append')
+@argh.arg('-n', '--name')
+def containers(label=None, name=None):
+    """List the containers started by docl"""
+    for container in work.registry.find(labels=label, name=name):
+        yield '{} {} {} {}'.format(container['id'][:12], container['ip'],
+                                   container.get('name') or '-',
+                                   container.get('image') or '-')
+
+
+@command
+def restart_services(container_id=None,
+                     timeout=constants.SERVICE_RESTART_TIMEOUT):
+    container_id = work.container_id(container_id)
+    services.restart(container_id, configuration.services,
+                     order=configuration.service_order,
+                     timeout=timeout)
 
 
 @command
-def restart_services(container_id=None):
-    container_id = container_id or work.last_container_id
-    for service in configuration.services:
-        _restart_service(container_id, service)
+def sync(container_id=None):
+    """Copy changed sources into a container started with --sync"""
+    container_id = work.container_id(container_id)
+    if not _sync_sources(container_id):
+        logger.info('Sources are up to date')
+
+
+@command
+def precompile(container_id=None, workers=constants.PRECOMPILE_WORKERS):
+    """Compile the packages mounted into a container into the source tree"""
+    container_id = work.container_id(container_id)
+    container = work.registry.get(container_id) or {}
+    mounts = dict((dst, src) for src, dst, _ in
+                  (m.split(':') for m in container.get('mounts') or []))
+    if not mounts:
+        raise argh.CommandError('Container {} has no mounted sources'
+                                .format(container_id))
+    image = container.get('image_id') or _image_id(container_id, '.Image')
+    for env, packages in configuration.env_packages.items():
+        version = _env_python_version(container_id, env)
+        if version is None:
+            continue
+        package_dirs = [
+            d for d in ('/opt/{}/env/lib/python{}.{}/site-packages/{}'.format(
+                env, version[0], version[1], package)
+                for package in packages)
+            if d in mounts]
+        if not package_dirs:
+            continue
+        # the mounts are read-only in the manager, so the files are written
+        # by a throwaway container of the same image, under the paths the
+        # services import them from
+        args = ['--rm', '--user', '{}:{}'.format(os.getuid(), os.getgid()),
+                '--entrypoint', '/opt/{}/env/bin/python'.format(env)]
+        for package_dir in package_dirs:
+            args += ['-v', '{}:{}:rw'.format(mounts[package_dir],
+                                             package_dir)]
+        args += [image, '-m', 'compileall', '-q']
+        if version >= (3, 5):
+            args += ['-j', str(workers)]
+        logger.info('Compiling {} packages with python {}.{}'
+                    .format(env, *version))
+        try:
+            with span('precompile {}'.format(env)):
+                quiet_docker.run(*(args + package_dirs))
+        except sh.ErrorReturnCode as e:
+            logger.warning('Failed compiling {} packages: {}'
+                           .format(env, e.stderr.strip() or e))
 
 
 @command
 def ssh(container_id=None):
     logger.warning('`docl ssh` is deprecated, use `docl shell` instead')
-    if not container_id:
-        container_ip = work.last_container_ip
-    else:
+    container_ip = work.container_ip(container_id)
+    if not container_ip:
         container_ip = _extract_container_ip(container_id)
     _ssh(container_ip, configuration.ssh_key_path)
 
 
 @command
 def shell(container_id=None):
-    container_id = container_id or work.last_container_id
+    container_id = work.container_id(container_id)
     # use os.execv so that docker gets the tty; there's no need for the
     # python side to wait anyway
     args = ['docker']
@@ -433,50 +1110,133 @@ def shell(container_id=None):
 
 
 @command
-def build_agent(container_id=None):
+def build_agent(container_id=None, workers=constants.AGENT_PACKAGE_WORKERS):
     logger.info('Rebuilding agent package')
-    container_id = container_id or work.last_container_id
-    quiet_docker('exec', container_id, 'tar', 'czf',
-                 configuration.agent_package_path, '-C',
-                 path(constants.AGENT_TEMPLATE_DIR).dirname(),
-                 path(constants.AGENT_TEMPLATE_DIR).basename())
+    container_id = work.container_id(container_id)
+    cp(source=resources.DIR / 'build_agent_package.py',
+       target=':{}'.format(constants.BUILD_AGENT_PACKAGE_TARGET_PATH),
+       container_id=container_id)
+    params = {
+        'agent_template_dir': constants.AGENT_TEMPLATE_DIR,
+        'agent_package_path': configuration.agent_package_path,
+        'cache_dir': constants.AGENT_PACKAGE_CACHE_DIR,
+        'workers': workers
+    }
+    with span('build agent package'):
+        output = quiet_docker('exec', container_id, 'python',
+                              constants.BUILD_AGENT_PACKAGE_TARGET_PATH,
+                              base64.b64encode(json.dumps(params)))
+    logger.info(str(output).strip())
 
 
 @command
-def watch(container_id=None, rebuild_agent=False, interval=2):
-    container_id = container_id or work.last_container_id
-    services_to_restart = set()
-    services_to_restart_lock = threading.Lock()
+@argh.arg('--poll', help='Detect changes by polling the source tree instead '
+                         'of using filesystem events, e.g. on NFS or sshfs.')
+@argh.arg('--metrics-path', help='Append the latency of each restart batch '
+                                 'to this file as JSON lines.')
+@argh.arg('--health-path', help='After restarting, wait for a 200 response '
+                                'to GET http://<container ip><HEALTH_PATH> '
+                                'and report it as the time the change was '
+                                'ready.')
+@argh.arg('-l', '--label', action='append',
+          help='Apply changes to every running container with this label '
+               '(KEY=VALUE) instead of a single container.')
+def watch(container_id=None, rebuild_agent=False,
+          quiet_period=constants.WATCH_QUIET_PERIOD,
+          max_wait=constants.WATCH_MAX_WAIT, sync=False, poll=False,
+          poll_interval=constants.WATCH_POLL_INTERVAL, metrics_path=None,
+          health_path=None, label=None, workers=constants.FLEET_WORKERS):
+    if label and container_id:
+        raise argh.CommandError('--label and --container-id are mutually '
+                                'exclusive')
+    if label:
+        # read on every batch, so containers started, stopped or removed
+        # while watching are picked up or dropped
+        def targets():
+            return [c for c in work.registry.find(labels=label)
+                    if not c.get('standby') and c.get('running', True)]
+    else:
+        container_id = work.container_id(container_id)
 
-    class Handler(events.FileSystemEventHandler):
-        def __init__(self, services):
-            self.services = set(services)
+        def targets():
+            return [work.registry.get(container_id) or {'id': container_id}]
+    report = metrics.LatencyReport(output_path=metrics_path)
+    watched = set()
 
-        def on_modified(self, event):
-            if event.is_directory:
-                with services_to_restart_lock:
-                    services_to_restart.update(self.services)
-    observer = observers.Observer()
-    for package, services in configuration.package_services.items():
-        src = '{}/{}/{}'.format(configuration.source_root,
-                                configuration.package_dir[package],
-                                package)
-        observer.schedule(Handler(services), path=src, recursive=True)
+    def apply_changes(container, changed, interrupted, detected):
+        try:
+            return _apply_changes(
+                container, changed,
+                interrupted=interrupted,
+                detected=detected,
+                rebuild_agent=rebuild_agent,
+                sync=sync,
+                report=report,
+                health_path=health_path)
+        except Exception as e:
+            logger.error('Failed applying changes to container {}: {}'
+                         .format(container['id'], e))
+            return []
+
+    def update_watched():
+        containers = targets()
+        current = set(c['id'] for c in containers)
+        for gone in watched - current:
+            logger.info('No longer watching container {}'.format(gone))
+        for new in current - watched:
+            logger.info('Watching container {}'.format(new))
+        watched.clear()
+        watched.update(current)
+        return containers
+
+    from multiprocessing.pool import ThreadPool
+    for container in update_watched():
+        # containers started with `run --sync` get their sources copied
+        if sync or container.get('sync'):
+            _sync_sources(container['id'])
+    index = watching.PackageIndex(configuration.source_root,
+                                  configuration.package_dir,
+                                  configuration.package_services)
+    path_filter = watching.PathFilter(configuration.watch_include,
+                                      configuration.watch_exclude)
+
+    def on_changed_paths(changed_paths):
+        changed = set()
+        for changed_path in changed_paths:
+            changed.update(watching.changed_services(
+                index, path_filter, changed_path))
+        debouncer.add(changed)
+
+    def restart_changed_services(changed, interrupted, detected):
+        containers = update_watched()
+        if not containers:
+            logger.info('No container to apply changes to')
+            return []
+        if len(containers) == 1:
+            return apply_changes(containers[0], changed, interrupted,
+                                 detected)
+        worker_pool = ThreadPool(min(len(containers), workers))
+        try:
+            results = worker_pool.map(
+                lambda c: apply_changes(c, changed, interrupted, detected),
+                containers)
+        finally:
+            worker_pool.close()
+            worker_pool.join()
+        return sorted(set(s for remaining in results for s in remaining))
+    debouncer = watching.Debouncer(restart_changed_services,
+                                   quiet_period=quiet_period,
+                                   max_wait=max_wait)
+    if poll:
+        observer = watching.Poller(index.package_paths.values(),
+                                   callback=on_changed_paths,
+                                   path_filter=path_filter,
+                                   interval=poll_interval)
+    else:
+        observer = _watchdog_observer(index.package_paths.values(),
+                                      on_changed_paths)
     observer.start()
-
-    scheduler = sched.scheduler(time.time, time.sleep)
-
-    def restart_changed_services():
-        with services_to_restart_lock:
-            current_services_to_restart = services_to_restart.copy()
-            services_to_restart.clear()
-        for service in current_services_to_restart:
-            if service == constants.AGENT_STUB_SERVICE and rebuild_agent:
-                build_agent(container_id)
-            else:
-                _restart_service(container_id, service)
-        scheduler.enter(interval, 1, restart_changed_services, ())
-    restart_changed_services()
+    _start_registry_sync()
 
     message = 'Filesystem watch started.'
     if rebuild_agent:
@@ -490,21 +1250,87 @@ def watch(container_id=None, rebuild_agent=False, interval=2):
                    .format(message))
     logger.info(message)
     try:
-        scheduler.run()
+        debouncer.run()
     except KeyboardInterrupt:
         pass
+    finally:
+        observer.stop()
+
+
+def _apply_changes(container, changed, interrupted, detected, rebuild_agent,
+                   sync, report, health_path):
+    """Restart the `changed` services of a watched container. Returns the
+    services postponed because more changes arrived."""
+    container_id = container['id']
+    # containers started with `run --sync` get their sources copied
+    if sync or container.get('sync'):
+        _sync_sources(container_id, restart=False)
+    # the agent stub is not a unit: it stands for rebuilding the agent
+    # package, which only happens with --rebuild-agent
+    build = rebuild_agent and constants.AGENT_STUB_SERVICE in changed
+    changed = changed - set([constants.AGENT_STUB_SERVICE])
+    timings = {}
+    remaining = services.restart(container_id, changed,
+                                 order=configuration.service_order,
+                                 reload=configuration.service_reload,
+                                 interrupted=interrupted,
+                                 timings=timings)
+    if build:
+        if remaining:
+            remaining.append(constants.AGENT_STUB_SERVICE)
+        else:
+            build_agent(container_id)
+    if remaining:
+        logger.info('More changes arrived, postponing restart of {} on {}'
+                    .format(', '.join(remaining), container_id))
+    elif timings:
+        healthy = None
+        if health_path:
+            healthy = _wait_healthy(container_id, health_path)
+        report.record(detected, timings, healthy=healthy,
+                      container_id=container_id)
+    return remaining
+
+
+def _wait_healthy(container_id, health_path):
+    container_ip = work.container_ip(container_id)
+    if not container_ip:
+        logger.warning('Skipping the health check of container {}: its IP '
+                       'is unknown'.format(container_id))
+        return None
+    url = 'http://{}{}'.format(container_ip, health_path)
+    try:
+        readiness.wait([readiness.HttpProbe(url, method='GET')])
+    except readiness.NotReadyError as e:
+        logger.warning(str(e))
+        return None
+    return time.time()
+
+
+def _watchdog_observer(paths, on_changed_paths):
+    from watchdog import events
+    from watchdog import observers
+
+    class Handler(events.FileSystemEventHandler):
+        def on_any_event(self, event):
+            on_changed_paths(watching.event_paths(event))
+    observer = observers.Observer()
+    handler = Handler()
+    for src in paths:
+        observer.schedule(handler, path=src, recursive=True)
+    return observer
 
 
 @command
 @argh.named('exec')
 def exc(command, container_id=None):
-    container_id = container_id or work.last_container_id
+    container_id = work.container_id(container_id)
     docker('exec', container_id, *shlex.split(command))
 
 
 @command
 def cp(source, target, container_id=None):
-    container_id = container_id or work.last_container_id
+    container_id = work.container_id(container_id)
     if source.startswith(':'):
         source = '{}{}'.format(container_id, source)
     elif target.startswith(':'):
@@ -515,6 +1341,37 @@ def cp(source, target, container_id=None):
     quiet_docker.cp(source, target)
 
 
+@command
+@argh.arg('--watch', help='Also keep a `docl watch` of the container (or '
+                          'of the containers with --label) running for as '
+                          'long as the daemon runs.')
+@argh.arg('-l', '--label', action='append',
+          help='With --watch, apply changes to every running container '
+               'with this label (KEY=VALUE).')
+def daemon(watch=False, container_id=None, label=None, rebuild_agent=False):
+    """Serve other docl invocations from this process until Ctrl+C"""
+    from docl import daemon as docl_daemon
+    from docl import main
+    if (label or container_id or rebuild_agent) and not watch:
+        raise argh.CommandError('--label, --container-id and '
+                                '--rebuild-agent only apply with --watch')
+    background = []
+    if watch:
+        background.append(lambda: _daemon_watch(container_id, label,
+                                                rebuild_agent))
+    try:
+        docl_daemon.serve(main.dispatch, on_start=_start_registry_sync,
+                          background=background)
+    except RuntimeError as e:
+        raise argh.CommandError(str(e))
+
+
+def _daemon_watch(container_id, label, rebuild_agent):
+    # `watch` is shadowed by the flag of the daemon command
+    watch(container_id=container_id, label=label,
+          rebuild_agent=rebuild_agent)
+
+
 @command
 def serve_install_rpm(invalidate_cache=False, no_progress=False):
     with install_rpm_server.with_server(invalidate_cache=invalidate_cache,
@@ -526,12 +1383,24 @@ def serve_install_rpm(invalidate_cache=False, no_progress=False):
                 break
 
 
-def _restart_service(container_id, service):
-    logger.info('Restarting {}'.format(service))
-    quiet_docker('exec', container_id, 'systemctl', 'restart', service)
+def _build_volumes():
+    return ['{}:{}:{}'.format(src, dst, permissions)
+            for src, dst, permissions in _source_mappings()]
 
 
-def _build_volumes():
+def _env_python_version(container_id, env):
+    """(major, minor) of the python of a manager virtualenv, or None if
+    the container doesn't have it"""
+    try:
+        output = quiet_docker(
+            'exec', container_id, '/opt/{}/env/bin/python'.format(env), '-c',
+            'import sys; print("%d.%d" % sys.version_info[:2])')
+        return tuple(int(v) for v in str(output).strip().split('.'))
+    except (sh.ErrorReturnCode, ValueError):
+        return None
+
+
+def _source_mappings():
     # resources should be able to override env packages which is why
     # we use a dist based in the destination directory
     volumes = {}
@@ -544,8 +1413,8 @@ def _build_volumes():
                                                                       package)
             dst2 = '/opt/{}/env/lib/python3.6/site-packages/{}'.format(env,
                                                                       package)
-            volumes[dst1] = '{}:{}:ro'.format(src, dst1)
-            volumes[dst2] = '{}:{}:ro'.format(src, dst2)
+            volumes[dst1] = (src, dst1, 'ro')
+            volumes[dst2] = (src, dst2, 'ro')
     for resource in configuration.resources:
         dst = resource['dst']
         # Might not be declared yet (e.g. cfy_manager)
@@ -558,43 +1427,43 @@ def _build_volumes():
         src = resource['src']
         if not path(src).isabs():
             src = '{}/{}'.format(configuration.source_root, src)
-        volumes[dst] = '{}:{}:{}'.format(src, dst, permissions)
+        volumes[dst] = (src, dst, permissions)
     return volumes.values()
 
 
 def _create_base_container(label, details_path, tag):
     docker_tag = tag or configuration.clean_image_docker_tag
-    docker.pull('cloudifyplatform/community:latest-centos7-base-image')
-    docker.tag('cloudifyplatform/community:latest-centos7-base-image',
-               configuration.clean_image_docker_tag)
+    with span('pull base image'):
+        docker.pull('cloudifyplatform/community:latest-centos7-base-image')
+        docker.tag('cloudifyplatform/community:latest-centos7-base-image',
+                   configuration.clean_image_docker_tag)
     container_id, container_ip = _run_container(docker_tag=docker_tag,
                                                 details_path=details_path,
                                                 label=label)
-    _retry(quiet_docker, 'exec', container_id, 'systemctl', 'start', 'dbus')
+    with span('start dbus'):
+        readiness.wait([readiness.CallProbe(
+            quiet_docker, 'exec', container_id, 'systemctl', 'start',
+            'dbus')])
     return container_id, container_ip
 
 
 def _run_container(docker_tag, volume=None, label=None, name=None,
-                   details_path=None):
-    label = label or []
+                   details_path=None, standby=False, run_args=None):
+    label = [constants.DOCL_CONTAINER_LABEL] + list(label or [])
     volume = volume or []
-    expose = configuration.expose
-    publish = configuration.publish
-    hostname = configuration.container_hostname
-    docker_args = ['--privileged', '--detach']
-    if name:
-        docker_args.append('--name={}'.format(name))
-    container_id = quiet_docker.run(
-        *docker_args +
-        ['--hostname={}'.format(hostname)] +
-        ['--expose={}'.format(e) for e in expose] +
-        ['--publish={}'.format(p) for p in publish] +
-        ['--volume={}'.format(v) for v in volume] +
-        ['--label={}'.format(l) for l in label] +
-        [docker_tag]).strip()
+    if run_args is None:
+        run_args = _container_run_args(volume=volume, label=label, name=name)
+    container_id = quiet_docker.run(*run_args + [docker_tag]).strip()
     container_ip = _extract_container_ip(container_id)
-    work.save_last_container_id_and_ip(container_id=container_id,
-                                       container_ip=container_ip)
+    work.register_container(container_id=container_id,
+                            container_ip=container_ip,
+                            name=name,
+                            image=docker_tag,
+                            image_id=_image_id(container_id, '.Image'),
+                            labels=label,
+                            mounts=volume,
+                            standby=standby,
+                            run_args=run_args)
     if details_path:
         _write_container_details(container_id=container_id,
                                  container_ip=container_ip,
@@ -602,32 +1471,67 @@ def _run_container(docker_tag, volume=None, label=None, name=None,
     return container_id, container_ip
 
 
+def _container_run_args(volume, label, name):
+    expose = configuration.expose
+    publish = configuration.publish
+    hostname = configuration.container_hostname
+    docker_args = ['--privileged', '--detach']
+    if name:
+        docker_args.append('--name={}'.format(name))
+    return (docker_args +
+            ['--hostname={}'.format(hostname)] +
+            ['--expose={}'.format(e) for e in expose] +
+            ['--publish={}'.format(p) for p in publish] +
+            ['--volume={}'.format(v) for v in volume] +
+            ['--label={}'.format(l) for l in label])
+
+
+def _start_registry_sync():
+    sync = registry.EventsSync(
+        work.registry,
+        events=lambda: docker_events({'type': ['container'],
+                                      'event': ['start', 'die', 'stop',
+                                                'destroy']}),
+        inspect_ip=_extract_container_ip)
+    sync.start()
+    return sync
+
+
+def _image_id(name, field='.Id'):
+    return quiet_docker.inspect('--format={{%s}}' % field, name).strip()
+
+
 def _extract_container_ip(container_id):
     return quiet_docker.inspect(
-        '--format={{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}',
+        docker_api.CONTAINER_IP_FORMAT,
         container_id,
     ).strip()
 
 
 def _ssh_setup(container_id, container_ip):
+    with span('ssh setup'):
+        _apply_ssh_configuration(container_id, container_ip)
+
+
+def _apply_ssh_configuration(container_id, container_ip):
     logger.info('Applying ssh configuration to manager container')
     try:
         known_hosts = path('~/.ssh/known_hosts').expanduser()
-        # Known hosts file may not exist
-        ssh_keygen('-R', container_ip)
-        fingerprint = None
-        while not fingerprint:
-            fingerprint = ssh_keyscan(
-                container_ip).stdout.split('\n')[0].strip()
-            time.sleep(0.01)
-        if fingerprint and known_hosts.exists():
-            current = known_hosts.text()
-            prefix = ''
-            if not current.endswith('\n'):
-                prefix = '\n'
-            known_hosts.write_text(
-                '{}{}\n'.format(prefix, fingerprint), append=True)
-    except sh.ErrorReturnCode:
+        readiness.wait([readiness.TcpPortProbe(container_ip, 22)])
+        fingerprint, = readiness.wait([readiness.CallProbe(
+            lambda: ssh_keyscan(container_ip).stdout.split('\n')[0].strip(),
+            truthy=True)])
+        with _known_hosts_lock:
+            # Known hosts file may not exist
+            ssh_keygen('-R', container_ip)
+            if fingerprint and known_hosts.exists():
+                current = known_hosts.text()
+                prefix = ''
+                if not current.endswith('\n'):
+                    prefix = '\n'
+                known_hosts.write_text(
+                    '{}{}\n'.format(prefix, fingerprint), append=True)
+    except (sh.ErrorReturnCode, readiness.NotReadyError):
         pass
     quiet_docker('exec', container_id, 'mkdir', '-p', '/root/.ssh')
     ssh_public_key = ssh_keygen('-y', '-f', configuration.ssh_key_path).strip()
@@ -643,6 +1547,7 @@ def _ssh_setup(container_id, container_ip):
 
 
 def _write_config(container_ip, config_path):
+    import yaml
     path(config_path).write_text(yaml.safe_dump({
         'manager': {
             'public_ip': container_ip,
@@ -664,6 +1569,7 @@ def _write_config(container_ip, config_path):
 
 
 def _write_container_details(container_id, container_ip, details_path):
+    import yaml
     path(details_path).write_text(yaml.safe_dump({
         'id': container_id,
         'ip': container_ip,
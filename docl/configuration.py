@@ -14,17 +14,93 @@
 # limitations under the License.
 ############
 
+import json
 import os
 
 import argh
-import yaml
 from path import path
 
 from docl import constants
 
 
+_string_types = (str, type(u''))
+_sequence_types = (list, tuple)
+
+# key -> (allowed types, required)
+_SCHEMA = {
+    'ssh_key_path': (_string_types, True),
+    'docker_host': (_string_types, True),
+    'docker_backend': (_string_types, False),
+    'clean_image_docker_tag': (_string_types, False),
+    'manager_image_docker_tag': (_string_types, False),
+    'source_root': (_string_types, False),
+    'workdir': (_string_types, True),
+    'services': (_sequence_types, False),
+    'expose': (_sequence_types, False),
+    'publish': (_sequence_types, False),
+    'container_hostname': (_string_types, False),
+    'package_dir': (dict, False),
+    'package_services': (dict, False),
+    'service_order': (dict, False),
+    'service_reload': (dict, False),
+    'env_packages': (dict, False),
+    'watch_include': (_sequence_types, False),
+    'watch_exclude': (_sequence_types, False),
+    'resources': (_sequence_types, False),
+    'agent_package_path': (_string_types, False),
+    'manager_image_url': (_string_types + (type(None),), False),
+    'manager_image_commit_sha_url': (_string_types + (type(None),), False),
+    'manager_image_layers_url': (_string_types + (type(None),), False),
+    'debug_ip': (_string_types + (type(None),), False),
+    'pool_size': (int, False),
+    'snapshot_disk_budget': (int, False),
+    'image_cache_disk_budget': (int, False),
+    'compression': (_string_types, False),
+    'compression_level': ((int, type(None)), False),
+    'compression_threads': (int, False),
+}
+
+
+class _FrozenDict(dict):
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('Configuration snapshot is read-only')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return _FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _validate(conf, conf_path):
+    if not isinstance(conf, dict):
+        raise argh.CommandError('Invalid configuration file {}'
+                                .format(conf_path))
+    for key, (types, required) in _SCHEMA.items():
+        if key not in conf:
+            if required:
+                raise argh.CommandError(
+                    'Invalid configuration file {}: missing "{}". '
+                    'Run "docl init --reset"'.format(conf_path, key))
+            continue
+        if not isinstance(conf[key], types):
+            raise argh.CommandError(
+                'Invalid configuration file {}: unexpected type for "{}"'
+                .format(conf_path, key))
+
+
 class Configuration(object):
 
+    def __init__(self):
+        self._snapshot = None
+        self._snapshot_key = None
+
     def save(self,
              docker_host,
              ssh_key_path,
@@ -35,18 +111,21 @@ class Configuration(object):
              reset,
              debug_ip,
              manager_image_url,
-             manager_image_commit_sha_url):
+             manager_image_commit_sha_url,
+             docker_backend=constants.DOCKER_BACKEND):
         if not self.conf_dir.exists():
             self.conf_dir.mkdir()
         conf = self.conf_dir / 'config.yaml'
         if conf.exists() and not reset:
             raise argh.CommandError('Already initialized. '
                                     'Run "docl init --reset"')
+        import yaml
         workdir = workdir or self.conf_dir / 'work'
         workdir = path(workdir).expanduser().abspath()
         conf.write_text(yaml.safe_dump({
             'ssh_key_path': str(ssh_key_path),
             'docker_host': docker_host,
+            'docker_backend': docker_backend,
             'clean_image_docker_tag': clean_image_docker_tag,
             'manager_image_docker_tag': manager_image_docker_tag,
             'source_root': source_root,
@@ -57,13 +136,25 @@ class Configuration(object):
             'container_hostname': constants.HOSTNAME,
             'package_dir': constants.PACKAGE_DIR,
             'package_services': constants.PACKAGE_SERVICES,
+            'service_order': constants.SERVICE_ORDER,
+            'service_reload': constants.SERVICE_RELOAD,
             'env_packages': constants.ENV_PACKAGES,
+            'watch_include': constants.WATCH_INCLUDE,
+            'watch_exclude': constants.WATCH_EXCLUDE,
             'resources': constants.RESOURCES,
             'agent_package_path': constants.AGENT_PACKAGE_PATH,
             'manager_image_url': manager_image_url,
             'manager_image_commit_sha_url': manager_image_commit_sha_url,
-            'debug_ip': debug_ip
+            'manager_image_layers_url': constants.MANAGER_IMAGE_LAYERS_URL,
+            'debug_ip': debug_ip,
+            'pool_size': constants.POOL_SIZE,
+            'snapshot_disk_budget': constants.SNAPSHOT_DISK_BUDGET,
+            'image_cache_disk_budget': constants.IMAGE_CACHE_DISK_BUDGET,
+            'compression': constants.COMPRESSION,
+            'compression_level': constants.COMPRESSION_LEVEL,
+            'compression_threads': constants.COMPRESSION_THREADS
         }, default_flow_style=False))
+        self.reload()
 
     @property
     def conf_dir(self):
@@ -76,14 +167,57 @@ class Configuration(object):
 
     @property
     def conf(self):
-        if not self.conf_path.exists():
+        """A read-only snapshot of the parsed configuration file.
+
+        The file is only re-read and re-validated when its path, inode,
+        mtime or size changed since the last load.
+        """
+        conf_path = self.conf_path
+        try:
+            stat = os.stat(conf_path)
+        except OSError:
             raise argh.CommandError('Not initialized. Run "docl init"')
-        return yaml.safe_load(self.conf_path.text())
+        key = (conf_path, stat.st_ino, stat.st_mtime, stat.st_size)
+        if key != self._snapshot_key:
+            self._snapshot = _freeze(self._load(conf_path, list(key[1:])))
+            self._snapshot_key = key
+        return self._snapshot
+
+    def _load(self, conf_path, stat_key):
+        # Parsed configuration is cached as JSON next to the YAML file so
+        # most invocations don't pay for importing and running the YAML
+        # parser
+        cache_path = self.conf_dir / '.config.cache.json'
+        try:
+            cache = json.loads(cache_path.text())
+            if cache['stat'] == stat_key:
+                return cache['conf']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+        import yaml
+        conf = yaml.safe_load(conf_path.text())
+        _validate(conf, conf_path)
+        tmp_path = path('{}.{}'.format(cache_path, os.getpid()))
+        try:
+            tmp_path.write_text(json.dumps({'stat': stat_key, 'conf': conf}))
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError, TypeError, ValueError):
+            pass
+        return conf
+
+    def reload(self):
+        """Drop the cached snapshot so the next access re-reads the file"""
+        self._snapshot = None
+        self._snapshot_key = None
 
     @property
     def docker_host(self):
         return self.conf.get('docker_host')
 
+    @property
+    def docker_backend(self):
+        return self.conf.get('docker_backend', constants.DOCKER_BACKEND)
+
     @property
     def ssh_key_path(self):
         return path(self.conf.get('ssh_key_path'))
@@ -124,10 +258,26 @@ class Configuration(object):
     def package_services(self):
         return self.conf.get('package_services')
 
+    @property
+    def service_order(self):
+        return self.conf.get('service_order', constants.SERVICE_ORDER)
+
+    @property
+    def service_reload(self):
+        return self.conf.get('service_reload', constants.SERVICE_RELOAD)
+
     @property
     def env_packages(self):
         return self.conf.get('env_packages')
 
+    @property
+    def watch_include(self):
+        return self.conf.get('watch_include', constants.WATCH_INCLUDE)
+
+    @property
+    def watch_exclude(self):
+        return self.conf.get('watch_exclude', constants.WATCH_EXCLUDE)
+
     @property
     def resources(self):
         return self.conf.get('resources')
@@ -148,9 +298,41 @@ class Configuration(object):
     def manager_image_commit_sha_url(self):
         return self.conf.get('manager_image_commit_sha_url')
 
+    @property
+    def manager_image_layers_url(self):
+        return self.conf.get('manager_image_layers_url',
+                             constants.MANAGER_IMAGE_LAYERS_URL)
+
     @property
     def debug_ip(self):
         return self.conf.get('debug_ip')
 
+    @property
+    def pool_size(self):
+        return self.conf.get('pool_size', constants.POOL_SIZE)
+
+    @property
+    def snapshot_disk_budget(self):
+        return self.conf.get('snapshot_disk_budget',
+                             constants.SNAPSHOT_DISK_BUDGET)
+
+    @property
+    def image_cache_disk_budget(self):
+        return self.conf.get('image_cache_disk_budget',
+                             constants.IMAGE_CACHE_DISK_BUDGET)
+
+    @property
+    def compression(self):
+        return self.conf.get('compression', constants.COMPRESSION)
+
+    @property
+    def compression_level(self):
+        return self.conf.get('compression_level', constants.COMPRESSION_LEVEL)
+
+    @property
+    def compression_threads(self):
+        return self.conf.get('compression_threads',
+                             constants.COMPRESSION_THREADS)
+
 
 configuration = Configuration()
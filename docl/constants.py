@@ -15,6 +15,9 @@
 
 CONFIG_YAML = 'config.yaml'
 DOCKER_HOST = 'fd://'
+DOCKER_BACKEND = 'api'
+DOCKER_BACKENDS = ('api', 'cli')
+DOCKER_API_POOL_SIZE = 8
 SSH_KEY = '~/.ssh/.id_rsa'
 CLEAN_IMAGE_DOCKER_TAG = 'cloudify/centos:7'
 MANAGER_IMAGE_DOCKER_TAG = 'cloudify/centos-manager:7'
@@ -24,12 +27,44 @@ AGENT_PACKAGE_PATH = '/opt/manager/resources/packages/agents/centos-core-agent.t
 AGENT_TEMPLATE_DIR = '/opt/agent-template'
 AGENT_STUB_SERVICE = 'agent-service'
 DOCL_HOME_ENV_VAR = 'DOCL_HOME'
+# set to run a command in process even if a docl daemon is running
+DOCL_NO_DAEMON_ENV_VAR = 'DOCL_NO_DAEMON'
+DOCL_CONTAINER_LABEL = 'docl.managed=true'
 PREPARE_SAVE_IMAGE_TARGET_PATH = '/root/prepare_save_image.py'
+PRECOMPILE_WORKERS = 4
+# modules docl must not import before a command is dispatched
+STARTUP_HEAVY_MODULES = ('requests', 'yaml', 'watchdog.observers',
+                         'cloudify_cli.env', 'cloudify_rest_client',
+                         'multiprocessing.pool')
+STARTUP_BUDGET_MS = 500
+SYNC_MANIFEST_PATH = '/root/.docl-sync-manifest.json'
+BUILD_AGENT_PACKAGE_TARGET_PATH = '/root/build_agent_package.py'
+AGENT_PACKAGE_CACHE_DIR = '/root/.agent-package-cache'
+AGENT_PACKAGE_WORKERS = 4
 DATA_JSON_TARGET_PATH = '/root/data.json'
 CLOUDIFY_CONTEXT_PATH = '/root/.cloudify/profiles/localhost/context'
 INSTALL_RPM_PATH = '/root/cloudify-manager-install.rpm'
 BUFFER_SIZE = 1024 * 64
+DOWNLOAD_CONNECTIONS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 ** 2 * 64
+DOWNLOAD_STATE_INTERVAL = 1024 ** 2 * 16
+# chunks of BUFFER_SIZE buffered between the download and docker load
+STREAM_QUEUE_SIZE = 64
+# pigz writes gzip (falling back to gzip itself when not installed); a level
+# of None uses the tool's default and 0 threads uses all cores
+COMPRESSION = 'pigz'
+COMPRESSION_LEVEL = None
+COMPRESSION_THREADS = 0
+READINESS_TIMEOUT = 60
+FLEET_WORKERS = 8
+POOL_SIZE = 0
+SNAPSHOT_IMAGE_REPOSITORY = 'docl-snapshot'
+SNAPSHOT_DISK_BUDGET = 20 * 1024 ** 3
+IMAGE_CACHE_DISK_BUDGET = 20 * 1024 ** 3
+READINESS_INITIAL_DELAY = 0.05
+READINESS_MAX_DELAY = 0.5
 MANAGER_IMAGE_URL = 'http://cloudify-tests-files.s3.amazonaws.com/docl-images/docl-manager.tar.gz'  # noqa
+MANAGER_IMAGE_LAYERS_URL = None
 MANAGER_IMAGE_COMMIT_SHA_URL = 'http://cloudify-tests-files.s3.amazonaws.com/docl-images/docl-manager.sha1'  # noqa
 
 
@@ -119,6 +154,37 @@ PACKAGE_SERVICES = {
     'cloudify_handler': (AGENT_STUB_SERVICE,),
 }
 
+SERVICE_ORDER = {}
+# service -> {'signal': NAME} or {'command': SHELL_COMMAND}; used by watch
+# instead of a full restart
+SERVICE_RELOAD = {
+    'cloudify-restservice': {'signal': 'HUP'},
+}
+SERVICE_RESTART_TIMEOUT = 120
+WATCH_QUIET_PERIOD = 0.5
+WATCH_MAX_WAIT = 5.0
+WATCH_POLL_INTERVAL = 1.0
+METRICS_WINDOW = 100
+WATCH_INCLUDE = ('*.py',)
+WATCH_EXCLUDE = (
+    '.git',
+    '__pycache__',
+    'tests',
+    '*.pyc',
+    '*.swp',
+    '*~',
+    '.#*',
+)
+
+SYNC_EXCLUDE = (
+    '.git',
+    '__pycache__',
+    '*.pyc',
+    '*.swp',
+    '*~',
+    '.#*',
+)
+
 ENV_PACKAGES = {
     'amqpinflux': (
         'amqp_influxdb',
@@ -0,0 +1,226 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Optional long-lived docl process serving commands over a unix socket.
+
+The client side is imported on every docl invocation, so this module only
+imports the standard library at the top.
+"""
+
+import errno
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+from docl import constants
+
+# commands that need the caller's terminal or block until interrupted
+LOCAL_COMMANDS = ('daemon', 'shell', 'ssh', 'watch', 'serve-install-rpm')
+
+
+def socket_path():
+    home = os.environ.get(constants.DOCL_HOME_ENV_VAR, '~/.docl')
+    return os.path.join(os.path.expanduser(home), 'docl.sock')
+
+
+def forward(argv):
+    """Run a command through a running daemon.
+
+    Returns None if the command was not forwarded (no daemon is running or
+    the command must run locally), otherwise the command's errors (an
+    empty string on success).
+    """
+    if _command_name(argv) in LOCAL_COMMANDS + (None,) or \
+            os.environ.get(constants.DOCL_NO_DAEMON_ENV_VAR):
+        return None
+    sock = _connect()
+    if not sock:
+        return None
+    stream = sock.makefile('rwb')
+    try:
+        stream.write(_encode({'argv': argv,
+                              'cwd': os.getcwd(),
+                              'env': dict(os.environ)}))
+        stream.flush()
+        for line in stream:
+            message = json.loads(line.decode('utf-8'))
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            else:
+                return message.get('errors') or ''
+        return 'error: docl daemon closed the connection'
+    finally:
+        stream.close()
+        sock.close()
+
+
+def _connect():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except socket.error as e:
+        sock.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+    return sock
+
+
+def serve(dispatch, on_start=None, background=()):
+    """Serve commands until interrupted.
+
+    `dispatch(argv)` runs a command in process, writing its output to
+    sys.stdout, and returns its errors. Each command runs in a process
+    forked from this one, so it starts with everything this process has
+    imported and loaded, and concurrent commands don't wait for each other
+    or share a working directory and environment. Each of the `background`
+    callables runs in a process of its own for as long as the daemon does.
+    """
+    try:
+        import SocketServer as socketserver
+    except ImportError:
+        import socketserver
+    from docl import logs
+
+    output = _Output(sys.stdout)
+    sys.stdout = output
+    # route log records through the redirected stdout as well
+    logs.setup_logging()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+
+            def write(text):
+                self.wfile.write(_encode({'out': text}))
+                self.wfile.flush()
+            errors = _run(dispatch, request, output, write)
+            self.wfile.write(_encode({'errors': errors}))
+
+    class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    path = socket_path()
+    running = _connect()
+    if running:
+        running.close()
+        raise RuntimeError('A docl daemon is already listening on {}'
+                           .format(path))
+    if os.path.exists(path):
+        os.remove(path)
+    # only the user running the daemon may connect to it
+    umask = os.umask(0o177)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(umask)
+    # forked before any thread is started by on_start
+    pids = [_fork(target) for target in background]
+    try:
+        if on_start:
+            on_start()
+        logs.logger.info('docl daemon listening on {}'.format(path))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in pids:
+            _stop(pid)
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+        sys.stdout = output.default
+        logs.setup_logging()
+
+
+def _run(dispatch, request, output, write):
+    # runs in a process of its own, which exits once the command is done
+    output.target = write
+    try:
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        return dispatch(request['argv'])
+    except SystemExit as e:
+        return str(e.code) if e.code else ''
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        output.target = None
+
+
+def _fork(target):
+    pid = os.fork()
+    if pid:
+        return pid
+    try:
+        target()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
+
+
+def _stop(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    except OSError:
+        # already gone, or reaped along with the command processes
+        pass
+
+
+class _Output(object):
+    """sys.stdout replacement sending writes to the current client"""
+
+    def __init__(self, default):
+        self.default = default
+        self.target = None
+
+    def write(self, text):
+        if self.target is None:
+            self.default.write(text)
+            return
+        if isinstance(text, bytes) and not isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        self.target(text)
+
+    def flush(self):
+        if self.target is None:
+            self.default.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.default, name)
+
+
+def _command_name(argv):
+    args = iter(argv)
+    for arg in args:
+        if arg == '--trace':
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def _encode(message):
+    return (json.dumps(message) + '\n').encode('utf-8')
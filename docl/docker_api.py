@@ -0,0 +1,595 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+from __future__ import absolute_import
+
+import base64
+import io
+import json
+import os
+import re
+import select
+import socket
+import struct
+import tarfile
+import threading
+
+try:
+    import httplib
+    from urllib import urlencode, quote
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlencode, quote
+
+import sh
+
+from docl import constants
+
+
+API_VERSION = 'v1.24'
+CONTAINER_IP_FORMAT = \
+    '--format={{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}'
+
+_FIELD_FORMAT = re.compile(
+    r'^--format=\{\{\.([A-Za-z]+(?:\.[A-Za-z]+)*)\}\}$')
+
+# requests that can safely be sent again when a pooled keep-alive
+# connection turns out to be closed
+_IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+# os.FileMode bits of the stat header of the archive endpoint
+_MODE_DIR = 1 << 31
+_MODE_SYMLINK = 1 << 27
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+class DockerApiError(Exception):
+
+    def __init__(self, status, message):
+        super(DockerApiError, self).__init__(
+            'Docker API error ({}): {}'.format(status, message))
+        self.status = status
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ConnectionPool(object):
+    """Keeps idle keep-alive connections to the docker daemon for reuse"""
+
+    def __init__(self, connection_factory, size):
+        self._factory = connection_factory
+        self._size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """An idle connection the daemon hasn't closed in the meantime (it
+        does so when restarted, or after an idle timeout), or else a new
+        one"""
+        dropped = []
+        connection = None
+        with self._lock:
+            while self._idle and connection is None:
+                connection = self._idle.pop()
+                if _dropped(connection):
+                    dropped.append(connection)
+                    connection = None
+        for stale in dropped:
+            stale.close()
+        return connection or self.connect()
+
+    def connect(self):
+        """A new connection, which is not taken from the idle ones"""
+        return self._factory()
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self._size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class DockerClient(object):
+    """Minimal Docker Engine API client over the daemon socket"""
+
+    def __init__(self, docker_host, pool_size=constants.DOCKER_API_POOL_SIZE):
+        scheme, _, address = docker_host.partition('://')
+        if scheme == 'unix':
+            factory = lambda: UnixHTTPConnection(address)
+        elif scheme in ('tcp', 'http'):
+            host, _, port = address.rstrip('/').partition(':')
+            factory = lambda: httplib.HTTPConnection(host, int(port or 2375))
+        else:
+            raise ValueError('Unsupported docker host for the Engine API: {}'
+                             .format(docker_host))
+        self.docker_host = docker_host
+        self.pool = ConnectionPool(factory, size=pool_size)
+
+    def _url(self, endpoint, params=None):
+        url = '/{}{}'.format(API_VERSION, endpoint)
+        if params:
+            url = '{}?{}'.format(url, urlencode(params))
+        return url
+
+    def _send(self, method, endpoint, params=None, body=None, headers=None):
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        url = self._url(endpoint, params)
+        connection = self.pool.acquire()
+        try:
+            connection.request(method, url, body=body, headers=headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            # the daemon may have acted on a request whose response got
+            # lost, so only idempotent requests are sent again
+            if method not in _IDEMPOTENT_METHODS:
+                raise
+            # keep-alive connection closed in flight, retry once on a fresh
+            # one
+            connection = self.pool.connect()
+            connection.request(method, url, body=body, headers=headers)
+            response = connection.getresponse()
+        return connection, response
+
+    def request(self, method, endpoint, params=None, body=None, headers=None):
+        connection, response = self._send(method, endpoint, params=params,
+                                          body=body, headers=headers)
+        data = response.read()
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(connection)
+        if response.status >= 400:
+            raise DockerApiError(response.status, _error_message(data))
+        return data
+
+    def stream(self, method, endpoint, params=None, body=None, headers=None):
+        """Return a response whose body is read incrementally.
+
+        The underlying connection is not returned to the pool.
+        """
+        connection, response = self._send(method, endpoint, params=params,
+                                          body=body, headers=headers)
+        if response.status >= 400:
+            data = response.read()
+            connection.close()
+            raise DockerApiError(response.status, _error_message(data))
+        return response
+
+    def json(self, method, endpoint, **kwargs):
+        data = self.request(method, endpoint, **kwargs)
+        return json.loads(_text(data)) if data else None
+
+    def version(self):
+        return self.json('GET', '/version')
+
+    def inspect_container(self, container_id):
+        return self.json('GET', '/containers/{}/json'.format(
+            quote(container_id)))
+
+    def inspect_image(self, image):
+        return self.json('GET', '/images/{}/json'.format(quote(image)))
+
+    def inspect(self, name):
+        """Inspect a container or, failing that, an image"""
+        try:
+            return self.inspect_container(name)
+        except DockerApiError as e:
+            if e.status != 404:
+                raise
+        return self.inspect_image(name)
+
+    def container_ip(self, container_id):
+        networks = self.inspect_container(
+            container_id)['NetworkSettings'].get('Networks') or {}
+        return ''.join(n.get('IPAddress') or '' for n in networks.values())
+
+    def containers(self, all=False, filters=None):
+        params = {'all': int(all)}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        return self.json('GET', '/containers/json', params=params)
+
+    def exec_run(self, container_id, command):
+        """Run `command` in the container, return (exit_code, out, err)"""
+        exec_id = self.json('POST', '/containers/{}/exec'.format(
+            quote(container_id)), body={
+                'Cmd': list(command),
+                'AttachStdout': True,
+                'AttachStderr': True,
+                'Tty': False})['Id']
+        response = self.stream('POST', '/exec/{}/start'.format(exec_id),
+                               body={'Detach': False, 'Tty': False})
+        stdout, stderr = _demultiplex(response)
+        exit_code = self.json('GET', '/exec/{}/json'.format(
+            exec_id))['ExitCode']
+        return exit_code, stdout, stderr
+
+    def stat_path(self, container_id, container_path):
+        """The stat of a path in the container (name, size, mode, mtime,
+        linkTarget), or None if it doesn't exist"""
+        connection, response = self._send(
+            'HEAD', '/containers/{}/archive'.format(quote(container_id)),
+            params={'path': container_path})
+        response.read()
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(connection)
+        if response.status == 404:
+            return None
+        if response.status >= 400:
+            raise DockerApiError(response.status, 'Failed to stat {}'
+                                 .format(container_path))
+        return json.loads(_text(base64.b64decode(
+            response.getheader('X-Docker-Container-Path-Stat'))))
+
+    def put_archive(self, container_id, target_dir, data):
+        self.request('PUT', '/containers/{}/archive'.format(
+            quote(container_id)), params={'path': target_dir}, body=data,
+            headers={'Content-Type': 'application/x-tar'})
+
+    def remove_container(self, container_id, force=False):
+        self.request('DELETE', '/containers/{}'.format(quote(container_id)),
+                     params={'force': int(force)})
+
+    def restart(self, container_id, timeout=None):
+        params = {'t': timeout} if timeout is not None else None
+        self.request('POST', '/containers/{}/restart'.format(
+            quote(container_id)), params=params)
+
+    def stop(self, container_id, timeout=None):
+        params = {'t': timeout} if timeout is not None else None
+        self.request('POST', '/containers/{}/stop'.format(
+            quote(container_id)), params=params)
+
+    def events(self, filters=None):
+        """Yield decoded events from the daemon's events stream"""
+        params = {'filters': json.dumps(filters)} if filters else None
+        response = self.stream('GET', '/events', params=params)
+        buf = b''
+        try:
+            for chunk in _iter_chunks(response):
+                buf += chunk
+                while b'\n' in buf:
+                    line, buf = buf.split(b'\n', 1)
+                    if line.strip():
+                        yield json.loads(_text(line))
+        finally:
+            response.close()
+
+    def commit(self, container_id, repository, tag=None):
+        params = {'container': container_id, 'repo': repository}
+        if tag:
+            params['tag'] = tag
+        return self.json('POST', '/commit', params=params)['Id']
+
+
+class ApiDocker(object):
+    """Engine API backed stand-in for the baked `docker` sh command.
+
+    Supports the subset of docker CLI invocations docl issues repeatedly
+    and delegates everything else to the CLI `fallback` command.
+    """
+
+    def __init__(self, client, fallback):
+        self._client = client
+        self._fallback = fallback
+
+    def __call__(self, subcommand, *args, **kwargs):
+        return getattr(self, subcommand)(*args, **kwargs)
+
+    def __getattr__(self, name):
+        handler = _HANDLERS.get(name)
+        if not handler:
+            return getattr(self._fallback, name)
+
+        def fallback(*args, **kwargs):
+            return getattr(self._fallback, name)(*args, **kwargs)
+
+        def call(*args, **kwargs):
+            args = _flatten(args)
+            if kwargs and set(kwargs) - handler.kwargs:
+                return fallback(*args, **kwargs)
+            try:
+                return handler(self._client, *args, **kwargs)
+            except _Unsupported:
+                return fallback(*args, **kwargs)
+            except (DockerApiError, httplib.HTTPException,
+                    socket.error) as e:
+                raise _error_return_code(
+                    ['docker', name] + list(args), 1, '', str(e))
+        return call
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _handler(*kwargs):
+    def decorator(func):
+        func.kwargs = set(kwargs)
+        return func
+    return decorator
+
+
+@_handler()
+def _exec(client, container_id, *command):
+    if container_id.startswith('-') or not command:
+        raise _Unsupported()
+    exit_code, stdout, stderr = client.exec_run(container_id, command)
+    if exit_code:
+        raise _error_return_code(['docker', 'exec', container_id] +
+                                 list(command), exit_code, stdout, stderr)
+    return _text(stdout)
+
+
+@_handler()
+def _inspect(client, *args):
+    if len(args) != 2:
+        raise _Unsupported()
+    template, name = args
+    if template == CONTAINER_IP_FORMAT:
+        return client.container_ip(name)
+    # single field templates, e.g. --format={{.Image}}
+    match = _FIELD_FORMAT.match(template)
+    if not match:
+        raise _Unsupported()
+    value = client.inspect(name)
+    for field in match.group(1).split('.'):
+        if not isinstance(value, dict) or field not in value:
+            raise _Unsupported()
+        value = value[field]
+    if isinstance(value, (dict, list)):
+        raise _Unsupported()
+    if isinstance(value, bool):
+        value = str(value).lower()
+    return '{}\n'.format(value)
+
+
+@_handler()
+def _cp(client, source, target):
+    container_id, sep, target_path = target.partition(':')
+    if not sep or '/' in container_id or not os.path.isfile(source):
+        raise _Unsupported()
+    # like docker cp, copy into the target if it is a directory and to the
+    # target path otherwise
+    stat = client.stat_path(container_id, target_path)
+    if stat and stat['mode'] & _MODE_SYMLINK:
+        raise _Unsupported()
+    if stat and stat['mode'] & _MODE_DIR:
+        target_dir, name = target_path, os.path.basename(source)
+    elif target_path.endswith('/'):
+        # docker cp reports the missing (or non-directory) target
+        raise _Unsupported()
+    else:
+        target_dir, name = os.path.split(target_path)
+
+    def owned_by_root(tarinfo):
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = 'root'
+        return tarinfo
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as tar:
+        tar.add(source, arcname=name, filter=owned_by_root)
+    client.put_archive(container_id, target_dir or '/', data.getvalue())
+    return ''
+
+
+@_handler()
+def _ps(client, *args):
+    show_all = quiet = no_trunc = False
+    filters = {}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in ('-a', '--all'):
+            show_all = True
+        elif arg in ('-q', '--quiet'):
+            quiet = True
+        elif arg in ('-aq', '-qa'):
+            show_all = quiet = True
+        elif arg == '--no-trunc':
+            no_trunc = True
+        elif arg == '--filter' and args:
+            name, _, value = args.pop(0).partition('=')
+            filters.setdefault(name, []).append(value)
+        else:
+            raise _Unsupported()
+    if not quiet:
+        raise _Unsupported()
+    containers = client.containers(all=show_all, filters=filters)
+    id_length = None if no_trunc else 12
+    return ''.join('{}\n'.format(c['Id'][:id_length]) for c in containers)
+
+
+@_handler()
+def _rm(client, *args):
+    force = '-f' in args or '--force' in args
+    container_ids = [a for a in args if a not in ('-f', '--force')]
+    if any(c.startswith('-') for c in container_ids):
+        raise _Unsupported()
+    for container_id in container_ids:
+        client.remove_container(container_id, force=force)
+    return ''
+
+
+@_handler('time')
+def _restart(client, container_id, time=None):
+    client.restart(container_id, timeout=time)
+    return ''
+
+
+@_handler('time')
+def _stop(client, container_id, time=None):
+    client.stop(container_id, timeout=time)
+    return ''
+
+
+@_handler()
+def _commit(client, container_id, image):
+    repository, tag = image, None
+    if ':' in image.rsplit('/', 1)[-1]:
+        repository, tag = image.rsplit(':', 1)
+    return client.commit(container_id, repository, tag)
+
+
+@_handler()
+def _version(client, *args):
+    if args:
+        raise _Unsupported()
+    return json.dumps(client.version())
+
+
+_HANDLERS = {
+    'exec': _exec,
+    'inspect': _inspect,
+    'cp': _cp,
+    'ps': _ps,
+    'rm': _rm,
+    'restart': _restart,
+    'stop': _stop,
+    'commit': _commit,
+    'version': _version,
+}
+
+
+def _dropped(connection):
+    # nothing should arrive on an idle keep-alive connection: if it is
+    # readable, the daemon closed it
+    if connection.sock is None:
+        return False
+    readable, _, _ = select.select([connection.sock], [], [], 0)
+    return bool(readable)
+
+
+def supports(docker_host):
+    return (docker_host or '').partition('://')[0] in ('unix', 'tcp', 'http')
+
+
+def client(docker_host):
+    """Return the shared, pooled client for `docker_host`"""
+    global _clients, _clients_lock, _clients_pid
+    if _clients_pid != os.getpid():
+        # a forked process (such as a daemon command) must not use the
+        # connections pooled by its parent
+        _clients, _clients_lock = {}, threading.Lock()
+        _clients_pid = os.getpid()
+    with _clients_lock:
+        if docker_host not in _clients:
+            _clients[docker_host] = DockerClient(docker_host)
+        return _clients[docker_host]
+
+
+def _flatten(args):
+    result = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            result.extend(arg)
+        else:
+            result.append(arg)
+    return result
+
+
+def _demultiplex(response):
+    stdout, stderr = [], []
+    while True:
+        header = _read_exactly(response, 8)
+        if not header:
+            break
+        stream_type, size = struct.unpack('>BxxxL', header)
+        frame = _read_exactly(response, size)
+        (stderr if stream_type == 2 else stdout).append(frame)
+    response.close()
+    return b''.join(stdout), b''.join(stderr)
+
+
+def _iter_chunks(response):
+    # the events stream is chunked and never ends; read one chunk at a time
+    # instead of letting httplib wait for a full buffer
+    if not response.chunked:
+        while True:
+            line = response.fp.readline()
+            if not line:
+                return
+            yield line
+    while True:
+        size_line = response.fp.readline()
+        if not size_line:
+            return
+        size = int(size_line.split(b';')[0].strip() or b'0', 16)
+        if size == 0:
+            return
+        yield _read_exactly(response.fp, size)
+        response.fp.readline()
+
+
+def _read_exactly(response, size):
+    chunks = []
+    while size:
+        chunk = response.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _text(data):
+    if isinstance(data, bytes) and not isinstance(data, str):
+        return data.decode('utf-8', 'replace')
+    return data
+
+
+def _error_message(data):
+    try:
+        return json.loads(_text(data))['message']
+    except (ValueError, KeyError, TypeError):
+        return _text(data).strip()
+
+
+def _error_return_code(command, exit_code, stdout, stderr):
+    # raise the same exception type the sh based CLI backend would, so
+    # callers can keep handling sh.ErrorReturnCode
+    def _bytes(value):
+        return value.encode('utf-8') if not isinstance(value, bytes) \
+            else value
+    exception_type = getattr(sh, 'ErrorReturnCode_{}'.format(exit_code))
+    return exception_type(' '.join(command), _bytes(stdout), _bytes(stderr))
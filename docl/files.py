@@ -14,23 +14,194 @@
 # limitations under the License.
 ############
 
-import requests
-
-from cloudify_cli.utils import generate_progress_handler
-from cloudify_rest_client import bytes_stream_utils
-from cloudify_rest_client import client
+import json
+import os
+import threading
 
 from docl import constants
+from docl.logs import logger
 
 
-def download(url, output_path, no_progress):
-    response = requests.get(url, stream=True)
-    streamed_response = client.StreamedResponse(response)
+def download(url, output_path, no_progress,
+             connections=constants.DOWNLOAD_CONNECTIONS):
+    """Download `url` to `output_path`.
+
+    If the server supports range requests, the file is fetched in chunks
+    over several connections and the finished part of each chunk is
+    recorded in a state file next to the output, so an interrupted
+    download resumes where it stopped.
+    """
+    import requests
+    from cloudify_cli.utils import generate_progress_handler
+
     progress_handler = None
     if not no_progress:
         progress_handler = generate_progress_handler(output_path)
+    # servers that reject HEAD, or don't tell the size or range support,
+    # get the plain single connection download
+    head = requests.head(url, allow_redirects=True)
+    size = int(head.headers.get('Content-Length') or 0) if head.ok else 0
+    if connections > 1 and size and \
+            head.headers.get('Accept-Ranges') == 'bytes':
+        _RangedDownload(url=head.url,
+                        output_path=output_path,
+                        size=size,
+                        validator=(head.headers.get('ETag') or
+                                   head.headers.get('Last-Modified')),
+                        progress_handler=progress_handler).run(connections)
+    else:
+        _download_stream(url, output_path, progress_handler)
+
+
+def iter_download(url, no_progress, cache_path=None):
+    """Yield the body of `url` in BUFFER_SIZE chunks as it arrives.
+
+    With a `cache_path`, the body is also written there; the file only
+    appears once the download completed.
+    """
+    import requests
+    from cloudify_cli.utils import generate_progress_handler
+
+    response = requests.get(url, stream=True)
+    response.raise_for_status()
+    total = int(response.headers.get('Content-Length') or 0)
+    progress_handler = None
+    if not no_progress:
+        progress_handler = generate_progress_handler(cache_path or url)
+    tmp_path = '{}.tmp'.format(cache_path)
+    cache = open(tmp_path, 'wb') if cache_path else None
+    read = 0
+    try:
+        for chunk in response.iter_content(constants.BUFFER_SIZE):
+            if cache:
+                cache.write(chunk)
+            read += len(chunk)
+            if progress_handler and total:
+                progress_handler(read, total)
+            yield chunk
+        if total and read != total:
+            raise IOError('Connection closed while downloading {}'
+                          .format(url))
+    except BaseException:
+        if cache:
+            cache.close()
+            os.remove(tmp_path)
+        raise
+    if cache:
+        cache.close()
+        os.rename(tmp_path, cache_path)
+
+
+def _download_stream(url, output_path, progress_handler):
+    # the cloudify client packages are slow to import and only needed here
+    import requests
+    from cloudify_rest_client import bytes_stream_utils
+    from cloudify_rest_client import client
+
+    response = requests.get(url, stream=True)
+    response.raise_for_status()
+    streamed_response = client.StreamedResponse(response)
     bytes_stream_utils.write_response_stream_to_file(
         buffer_size=constants.BUFFER_SIZE,
         streamed_response=streamed_response,
         output_file=output_path,
         progress_callback=progress_handler)
+
+
+class _RangedDownload(object):
+
+    def __init__(self, url, output_path, size, validator, progress_handler):
+        self.url = url
+        self.output_path = output_path
+        self.size = size
+        self.validator = validator
+        self.progress_handler = progress_handler
+        self.state_path = '{}.download'.format(output_path)
+        self._lock = threading.Lock()
+        self._chunks = None
+        self._saved_done = 0
+
+    def run(self, connections):
+        self._chunks = self._load_state()
+        if self._chunks is None:
+            chunk_size = constants.DOWNLOAD_CHUNK_SIZE
+            self._chunks = [[start, min(start + chunk_size, self.size), 0]
+                            for start in range(0, self.size, chunk_size)]
+            with open(self.output_path, 'wb') as f:
+                f.truncate(self.size)
+            self._save_state()
+        else:
+            logger.info('Resuming download at {:.1f}%'.format(
+                100.0 * self._done() / self.size))
+        pending = [c for c in self._chunks if c[0] + c[2] < c[1]]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(connections, len(pending)) or 1)
+        try:
+            # waiting with a timeout keeps this interruptible on python 2
+            pool.map_async(self._fetch, pending).get(timeout=2 ** 31)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            with self._lock:
+                self._save_state()
+        pool.join()
+        os.remove(self.state_path)
+
+    def _fetch(self, chunk):
+        import requests
+        start, end, done = chunk
+        response = requests.get(
+            self.url, stream=True,
+            headers={'Range': 'bytes={}-{}'.format(start + done, end - 1)})
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError('Server ignored the range request for {}'
+                          .format(self.url))
+        with open(self.output_path, 'r+b') as f:
+            f.seek(start + done)
+            for data in response.iter_content(constants.BUFFER_SIZE):
+                data = data[:end - start - chunk[2]]
+                f.write(data)
+                f.flush()
+                with self._lock:
+                    chunk[2] += len(data)
+                    self._progress()
+        if start + chunk[2] < end:
+            raise IOError('Connection closed while downloading {}'
+                          .format(self.url))
+
+    def _done(self):
+        return sum(c[2] for c in self._chunks)
+
+    def _progress(self):
+        done = self._done()
+        if self.progress_handler:
+            self.progress_handler(done, self.size)
+        if done - self._saved_done >= constants.DOWNLOAD_STATE_INTERVAL:
+            self._save_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('url') != self.url or \
+                state.get('size') != self.size or \
+                state.get('validator') != self.validator or \
+                not os.path.exists(self.output_path):
+            return None
+        return state['chunks']
+
+    def _save_state(self):
+        # chunk progress only counts data already flushed to the file
+        tmp_path = '{}.tmp'.format(self.state_path)
+        with open(tmp_path, 'w') as f:
+            json.dump({'url': self.url,
+                       'size': self.size,
+                       'validator': self.validator,
+                       'chunks': self._chunks}, f)
+        os.rename(tmp_path, self.state_path)
+        self._saved_done = self._done()
@@ -0,0 +1,121 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import hashlib
+import os
+import time
+
+from path import path
+
+from docl.registry import JsonStore
+
+
+class ImageCache(JsonStore):
+    """Downloaded manager image files, keyed by the commit sha1 they were
+    built from (or a hash of their URL and ETag)
+
+    The index is stored next to the image files it describes. Each record
+    holds the image file name, its URL and size, and when it was downloaded
+    and last loaded.
+    """
+
+    def __init__(self, cache_dir):
+        self.dir = path(cache_dir)
+        if not self.dir.exists():
+            self.dir.makedirs()
+        super(ImageCache, self).__init__(self.dir / 'index.json')
+
+    def file_path(self, key):
+        return self.dir / '{}.image'.format(key)
+
+    def add(self, key, url, etag=None):
+        now = time.time()
+        record = {
+            'key': key,
+            'url': url,
+            'etag': etag,
+            'file': self.file_path(key).basename(),
+            'size': os.path.getsize(self.file_path(key)),
+            'created': now,
+            'last_used': now,
+        }
+        with self._modify() as images:
+            images[key] = record
+        return record
+
+    def get(self, key):
+        """The record of a cached image whose file is still there"""
+        record = self._read().get(key)
+        if record and self.file_path(key).exists():
+            return record
+        return None
+
+    def touch(self, key):
+        with self._modify() as images:
+            record = dict(images[key])
+            record['last_used'] = time.time()
+            images[key] = record
+        return record
+
+    def remove(self, key):
+        with self._modify() as images:
+            record = images.pop(key, None)
+        for file_path in (self.file_path(key),
+                          path('{}.download'.format(self.file_path(key)))):
+            if file_path.exists():
+                file_path.remove()
+        return record
+
+    def all(self):
+        """Cached images, least recently used first"""
+        return sorted(self._read().values(), key=lambda i: i['last_used'])
+
+    def over_budget(self, budget, keep=None):
+        """Least recently used images to evict so the rest fit `budget`
+        bytes. The `keep` image is never evicted."""
+        images = self.all()
+        total = sum(i['size'] for i in images)
+        evict = []
+        for image in images:
+            if total <= budget:
+                break
+            if image['key'] == keep:
+                continue
+            evict.append(image)
+            total -= image['size']
+        return evict
+
+    def orphans(self):
+        """Files in the cache dir no record refers to, such as the partial
+        files of interrupted downloads"""
+        known = set(i['file'] for i in self._read().values())
+        orphans = []
+        for file_path in self.dir.files():
+            name = file_path.basename()
+            if name.startswith(self.path.basename()):
+                continue
+            for suffix in ('.download', '.tmp'):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if name not in known:
+                orphans.append(file_path)
+        return orphans
+
+    @staticmethod
+    def url_key(url, etag):
+        """The key of an image identified by its URL and ETag"""
+        return hashlib.sha1('{}\n{}'.format(url, etag).encode('utf-8')) \
+            .hexdigest()
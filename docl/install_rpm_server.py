@@ -13,16 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import requests
 from contextlib import contextmanager
-from requests.exceptions import ConnectionError
 
 import sh
 import os
-import yaml
-from time import sleep
 
 from docl import files
+from docl import readiness
 from docl.configuration import configuration
 from docl.work import work
 from docl.logs import logger
@@ -69,17 +66,8 @@ def _serve():
     return process, local_rpm_url
 
 
-def _wait_for_file_server(url, max_retries=300):
-    while max_retries:
-        sleep(0.1)
-        max_retries -= 1
-        try:
-            result = requests.head(url)
-            if result.status_code == 200:
-                return
-        except ConnectionError:
-            pass
-    raise StandardError('Could not download requested URL: {0}'.format(url))
+def _wait_for_file_server(url):
+    readiness.wait([readiness.HttpProbe(url)])
 
 
 def _download_install_rpm(no_progress):
@@ -101,5 +89,6 @@ def get_rpm_url():
         'packages-urls',
         'manager-install-rpm.yaml'
     )
+    import yaml
     with open(rpm_path_yaml, 'r') as f:
         return yaml.load(f)
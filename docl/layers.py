@@ -0,0 +1,253 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Manager images published layer by layer.
+
+A layered image is a directory holding a manifest and one compressed blob
+per image layer, named after the layer's diff id. It can be served by any
+static HTTP server. Pulling it only downloads the layers whose chain id the
+docker daemon doesn't have yet and feeds docker load a tar stream holding
+just those: docker load skips the layers it already has without looking
+for their files.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import io
+import json
+import os
+import subprocess
+import tarfile
+
+import argh
+
+from docl import compression
+from docl import constants
+from docl import files
+from docl.logs import logger
+from docl.subprocess import docker_stream
+from docl.subprocess import quiet_docker
+
+MANIFEST = 'manifest.json'
+BLOBS_DIR = 'blobs'
+# members of a docker save stream up to this size are kept in memory.
+# Anything larger is a layer and is compressed to disk as it arrives
+INLINE_SIZE = 1024 ** 2
+
+
+def save(docker_tag, output_dir, codec, level=None, threads=None):
+    """Write the image `docker_tag` as a layered image to `output_dir`"""
+    blobs_dir = os.path.join(output_dir, BLOBS_DIR)
+    if not os.path.isdir(blobs_dir):
+        os.makedirs(blobs_dir)
+    compress = compression.compress_args(codec, level, threads)
+    inline = {}
+    stored = {}
+    links = {}
+    process = docker_stream('save', docker_tag)
+    try:
+        with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+            for member in tar:
+                if member.issym():
+                    links[member.name] = os.path.normpath(os.path.join(
+                        os.path.dirname(member.name), member.linkname))
+                elif not member.isfile():
+                    continue
+                elif member.size <= INLINE_SIZE:
+                    inline[member.name] = tar.extractfile(member).read()
+                else:
+                    stored[member.name] = _store_blob(
+                        tar.extractfile(member), blobs_dir, compress)
+    finally:
+        process.stdout.close()
+    if process.wait():
+        raise argh.CommandError('Failed saving image {}'.format(docker_tag))
+
+    docker_manifest = json.loads(inline[MANIFEST].decode('utf-8'))[0]
+    config_data = inline[links.get(docker_manifest['Config'],
+                                   docker_manifest['Config'])]
+    diff_ids = json.loads(config_data.decode('utf-8'))['rootfs']['diff_ids']
+    layers = []
+    for layer_path, diff_id in zip(docker_manifest['Layers'], diff_ids):
+        layer_path = links.get(layer_path, layer_path)
+        if layer_path not in stored:
+            stored[layer_path] = _store_blob(
+                io.BytesIO(inline[layer_path]), blobs_dir, compress)
+        digest, size, compressed_size = stored[layer_path]
+        layers.append({
+            'diff_id': diff_id,
+            'blob': '{}/{}'.format(BLOBS_DIR, digest),
+            'size': size,
+            'compressed_size': compressed_size,
+        })
+    used = set(os.path.basename(layer['blob']) for layer in layers)
+    for name in os.listdir(blobs_dir):
+        if name not in used:
+            os.remove(os.path.join(blobs_dir, name))
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    tmp_path = '{}.tmp'.format(manifest_path)
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'version': 1,
+            'image_id': _image_id(config_data),
+            'config': config_data.decode('utf-8'),
+            'layers': layers,
+        }, f, indent=2)
+    os.rename(tmp_path, manifest_path)
+    return layers
+
+
+def pull(base_url, docker_tag, download_dir, no_progress,
+         connections=constants.DOWNLOAD_CONNECTIONS,
+         current_image_id=None):
+    """Load the layered image at `base_url` into docker as `docker_tag`.
+    Returns its image id, or None if `current_image_id` already is it."""
+    import requests
+    base_url = base_url.rstrip('/')
+    response = requests.get('{}/{}'.format(base_url, MANIFEST))
+    response.raise_for_status()
+    manifest = response.json()
+    if manifest['image_id'] == current_image_id:
+        return None
+    layers = manifest['layers']
+    present = local_chain_ids()
+    missing = [layer for layer, chain_id
+               in zip(layers, chain_ids([l['diff_id'] for l in layers]))
+               if chain_id not in present]
+    logger.info('Downloading {} of {} layers ({:.1f}MB)'.format(
+        len(missing), len(layers),
+        sum(l['compressed_size'] for l in missing) / 1024.0 ** 2))
+    if not os.path.isdir(download_dir):
+        os.makedirs(download_dir)
+    blob_paths = {}
+    for layer in missing:
+        if layer['diff_id'] in blob_paths:
+            continue
+        blob_path = os.path.join(download_dir,
+                                 os.path.basename(layer['blob']))
+        # an interrupted download of the same layer is resumed
+        files.download(url='{}/{}'.format(base_url, layer['blob']),
+                       output_path=blob_path,
+                       no_progress=no_progress,
+                       connections=connections)
+        blob_paths[layer['diff_id']] = blob_path
+    logger.info('Loading layers into docker (may take a while)')
+    quiet_docker.load(_in=_load_stream(manifest, docker_tag, blob_paths),
+                      _in_bufsize=constants.BUFFER_SIZE)
+    for blob_path in blob_paths.values():
+        os.remove(blob_path)
+    return manifest['image_id']
+
+
+def chain_ids(diff_ids):
+    """The chain id of each layer of a stack of layers"""
+    result = []
+    for diff_id in diff_ids:
+        if result:
+            diff_id = 'sha256:{}'.format(hashlib.sha256('{} {}'.format(
+                result[-1], diff_id).encode('utf-8')).hexdigest())
+        result.append(diff_id)
+    return result
+
+
+def local_chain_ids():
+    """Chain ids of all layers of the images in the docker daemon"""
+    image_ids = set(str(quiet_docker.images('-q', '--no-trunc')).split())
+    if not image_ids:
+        return set()
+    result = set()
+    for line in str(quiet_docker.image(
+            'inspect', '--format', '{{json .RootFS.Layers}}',
+            *sorted(image_ids))).splitlines():
+        if line.strip():
+            result.update(chain_ids(json.loads(line) or []))
+    return result
+
+
+def _store_blob(layer, blobs_dir, compress):
+    """Compress a layer into blobs_dir, named after its sha256 (which is
+    the diff id of an uncompressed layer). Returns the digest and the
+    uncompressed and compressed sizes."""
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(blobs_dir, '.{}.tmp'.format(os.getpid()))
+    with open(tmp_path, 'wb') as out:
+        process = subprocess.Popen(compress, stdin=subprocess.PIPE,
+                                   stdout=out)
+        try:
+            for chunk in iter(lambda: layer.read(constants.BUFFER_SIZE),
+                              b''):
+                digest.update(chunk)
+                size += len(chunk)
+                process.stdin.write(chunk)
+        finally:
+            process.stdin.close()
+        if process.wait():
+            raise argh.CommandError('Failed compressing an image layer')
+    blob_path = os.path.join(blobs_dir, digest.hexdigest())
+    os.rename(tmp_path, blob_path)
+    return digest.hexdigest(), size, os.path.getsize(blob_path)
+
+
+def _load_stream(manifest, docker_tag, blob_paths):
+    """Yield a docker save tar stream of the image holding only the layers
+    in `blob_paths`"""
+    config_name = '{}.json'.format(manifest['image_id'].split(':')[-1])
+    layer_names = ['{}/layer.tar'.format(l['diff_id'].split(':')[-1])
+                   for l in manifest['layers']]
+    yield _tar_member(MANIFEST, json.dumps([{
+        'Config': config_name,
+        'RepoTags': [docker_tag],
+        'Layers': layer_names,
+    }]).encode('utf-8'))
+    yield _tar_member(config_name, manifest['config'].encode('utf-8'))
+    # a layer repeated higher up the stack is only needed once
+    written_names = set()
+    for layer, name in zip(manifest['layers'], layer_names):
+        blob_path = blob_paths.get(layer['diff_id'])
+        if not blob_path or name in written_names:
+            continue
+        written_names.add(name)
+        info = tarfile.TarInfo(name)
+        info.size = layer['size']
+        yield info.tobuf(format=tarfile.GNU_FORMAT)
+        process = subprocess.Popen(
+            compression.decompress_args(compression.detect_file(blob_path)) +
+            [blob_path], stdout=subprocess.PIPE)
+        written = 0
+        for chunk in iter(lambda: process.stdout.read(constants.BUFFER_SIZE),
+                          b''):
+            written += len(chunk)
+            yield chunk
+        if process.wait() or written != layer['size']:
+            raise IOError('Corrupt layer blob {}'.format(blob_path))
+        yield _padding(written)
+    yield b'\0' * tarfile.RECORDSIZE
+
+
+def _tar_member(name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    return info.tobuf(format=tarfile.GNU_FORMAT) + data + _padding(len(data))
+
+
+def _padding(size):
+    return b'\0' * (-size % tarfile.BLOCKSIZE)
+
+
+def _image_id(config_data):
+    return 'sha256:{}'.format(hashlib.sha256(config_data).hexdigest())
@@ -15,27 +15,68 @@
 
 
 import sys
+import time
 import StringIO
 
 import argh
 import argh.utils
 
-from docl import commands
+from docl import daemon
 from docl import logs
+from docl.tracing import tracer
 
 
 def main():
     logs.setup_logging()
+    argv = sys.argv[1:]
+    errors = daemon.forward(argv)
+    if errors is None:
+        errors = dispatch(argv)
+    if errors:
+        sys.exit(errors)
+
+
+def dispatch(argv):
+    """Run a docl command in this process and return its errors"""
+    from docl import commands
     parser = argh.ArghParser()
+    parser.add_argument(
+        '--trace', metavar='OUTPUT_PATH',
+        help='Record how long each phase and external command takes, write '
+             'the spans to OUTPUT_PATH in Chrome trace event format and '
+             'print a summary when the command ends.')
     subparsers_action = argh.utils.get_subparsers(parser, create=True)
     subparsers_action.metavar = ''
     parser.add_commands(commands.app.commands)
     errors = StringIO.StringIO()
-    parser.dispatch(errors_file=errors)
-    errors_value = errors.getvalue()
-    if errors_value:
-        errors_value = errors_value.replace('CommandError', 'error').strip()
-        sys.exit(errors_value)
+    trace_path = []
+    command_name = []
+
+    def pre_call(namespace):
+        command_name.append(namespace.get_function().__name__)
+        if namespace.trace:
+            trace_path.append(namespace.trace)
+            tracer.enable()
+    # a daemon dispatches many commands; each gets a trace of its own
+    tracer.enabled = False
+    del tracer.spans[:]
+    start = time.time()
+    try:
+        parser.dispatch(argv=argv, output_file=sys.stdout,
+                        errors_file=errors, pre_call=pre_call)
+    finally:
+        if trace_path:
+            tracer.record('docl {}'.format(command_name[0]),
+                          start, time.time(), category='command')
+            _write_trace(trace_path[0])
+    return errors.getvalue().replace('CommandError', 'error').strip()
+
+
+def _write_trace(output_path):
+    tracer.write_chrome_trace(output_path)
+    logs.logger.info('Trace written to {}'.format(output_path))
+    for line in tracer.summary():
+        logs.logger.info(line)
 
 
 if __name__ == '__main__':
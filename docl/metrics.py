@@ -0,0 +1,96 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import collections
+import json
+import math
+import threading
+import time
+
+from docl import constants
+from docl.logs import logger
+
+
+class LatencyReport(object):
+    """Edit-to-ready latencies of the restart batches of `docl watch`
+
+    Each batch records when its first change was detected, when its first
+    restart was issued, when its last restarted unit was active again and,
+    if a health check is configured, when it passed. Reloaded units are
+    listed as unverified and left out of the active time, since systemd
+    reports them active before the reload finished. Percentiles over the last
+    `window` batches are logged after each batch; with an `output_path`,
+    every batch is also appended to it as a JSON line.
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, output_path=None, window=constants.METRICS_WINDOW):
+        self.output_path = output_path
+        self._samples = collections.deque(maxlen=window)
+        # restarts of several containers are reported concurrently
+        self._lock = threading.Lock()
+
+    def record(self, detected, timings, healthy=None, container_id=None):
+        """`timings` maps each restarted service to its issued and active
+        times, as filled in by services.restart"""
+        issued = min(t['issued'] for t in timings.values())
+        active = max([t['active'] for t in timings.values()
+                      if not t.get('reloaded')] or [None])
+        sample = {
+            'time': time.time(),
+            'container_id': container_id,
+            'services': sorted(timings),
+            'unverified': sorted(s for s, t in timings.items()
+                                 if t.get('reloaded')),
+            'detected': detected,
+            'issued': issued,
+            'active': active,
+            'healthy': healthy,
+            'detect_to_issue': issued - detected,
+            'detect_to_active': active - detected if active else None,
+            'detect_to_healthy': healthy - detected if healthy else None,
+        }
+        with self._lock:
+            self._samples.append(sample)
+            if self.output_path:
+                with open(self.output_path, 'a') as f:
+                    f.write(json.dumps(sample, sort_keys=True) + '\n')
+            for line in self.summary():
+                logger.info(line)
+        return sample
+
+    def summary(self):
+        lines = []
+        for key, title in (('detect_to_issue', 'Change to restart'),
+                           ('detect_to_active', 'Change to active'),
+                           ('detect_to_healthy', 'Change to healthy')):
+            values = [s[key] for s in self._samples if s[key] is not None]
+            if not values:
+                continue
+            lines.append('{}: last {:.2f}s, {} (n={})'.format(
+                title, values[-1],
+                ', '.join('p{} {:.2f}s'.format(p, percentile(values, p))
+                          for p in self.PERCENTILES),
+                len(values)))
+        return lines
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
@@ -0,0 +1,73 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import fcntl
+import time
+from contextlib import contextmanager
+
+from docl.work import work
+
+
+def standby(docker_tag=None, mounts=None):
+    """Standby records, optionally only those matching a tag and mounts"""
+    return [c for c in work.registry.all()
+            if _matches(c, docker_tag, mounts)]
+
+
+def claim(docker_tag, mounts, image_id, **fields):
+    """Take a ready standby container out of the pool.
+
+    Only containers started from the current `image_id` of `docker_tag`
+    with the same mounts are claimed.
+    """
+    fields.update({'standby': False, 'created': time.time()})
+    return work.registry.claim(
+        lambda c: (_matches(c, docker_tag, mounts) and
+                   c.get('image_id') == image_id),
+        **fields)
+
+
+def stale(docker_tag, image_id):
+    """Standby containers started from a previous commit of `docker_tag`"""
+    return [c for c in standby(docker_tag)
+            if c.get('image_id') != image_id]
+
+
+@contextmanager
+def fill_lock():
+    """Yield whether this process may fill the pool; only one fill runs at
+    a time"""
+    with open(work.dir / 'pool.lock', 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _matches(record, docker_tag, mounts):
+    if not record.get('standby'):
+        return False
+    if docker_tag and record.get('image') != docker_tag:
+        return False
+    if mounts is not None and \
+            sorted(record.get('mounts') or []) != sorted(mounts):
+        return False
+    return True
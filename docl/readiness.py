@@ -0,0 +1,180 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import random
+import socket
+import threading
+import time
+
+import argh
+import sh
+
+from docl import constants
+from docl.subprocess import quiet_docker
+
+
+class NotReadyError(argh.CommandError):
+    pass
+
+
+class Probe(object):
+    """Something that becomes ready eventually.
+
+    `check` returns a truthy value once ready. Raising one of `errors`
+    means not ready yet, any other exception aborts the wait.
+    """
+
+    errors = ()
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def check(self):
+        raise NotImplementedError()
+
+
+class CallProbe(Probe):
+    """Ready once `func(*args, **kwargs)` returns without a failed command"""
+
+    errors = (sh.ErrorReturnCode,)
+
+    def __init__(self, func, *args, **kwargs):
+        super(CallProbe, self).__init__(timeout=kwargs.pop('timeout', None))
+        self.truthy = kwargs.pop('truthy', False)
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def check(self):
+        result = self.func(*self.args, **self.kwargs)
+        if self.truthy:
+            return result
+        return result if result else True
+
+    def __str__(self):
+        return getattr(self.func, '__name__', str(self.func))
+
+
+class TcpPortProbe(Probe):
+
+    errors = (socket.error,)
+
+    def __init__(self, host, port, timeout=None):
+        super(TcpPortProbe, self).__init__(timeout=timeout)
+        self.host = host
+        self.port = port
+
+    def check(self):
+        sock = socket.create_connection((self.host, self.port), timeout=1)
+        sock.close()
+        return True
+
+    def __str__(self):
+        return 'tcp port {}:{}'.format(self.host, self.port)
+
+
+class HttpProbe(Probe):
+
+    def __init__(self, url, status_code=200, method='HEAD', timeout=None):
+        super(HttpProbe, self).__init__(timeout=timeout)
+        self.url = url
+        self.status_code = status_code
+        self.method = method
+
+    @property
+    def errors(self):
+        import requests
+        return (requests.RequestException,)
+
+    def check(self):
+        import requests
+        response = requests.request(self.method, self.url, timeout=5)
+        return response.status_code == self.status_code
+
+    def __str__(self):
+        return 'HTTP {} {}'.format(self.status_code, self.url)
+
+
+class SystemdUnitProbe(Probe):
+
+    errors = (sh.ErrorReturnCode,)
+
+    def __init__(self, container_id, unit, timeout=None):
+        super(SystemdUnitProbe, self).__init__(timeout=timeout)
+        self.container_id = container_id
+        self.unit = unit
+
+    def check(self):
+        quiet_docker('exec', self.container_id,
+                     'systemctl', 'is-active', '--quiet', self.unit)
+        return True
+
+    def __str__(self):
+        return 'systemd unit {}'.format(self.unit)
+
+
+def wait(probes, timeout=constants.READINESS_TIMEOUT):
+    """Poll all `probes` concurrently until each of them is ready.
+
+    Probes back off exponentially with jitter between attempts. Returns
+    the probes' results in order, raises NotReadyError once a probe's
+    deadline (its own `timeout`, or `timeout`) passes.
+    """
+    probes = list(probes)
+    if len(probes) == 1:
+        return [_poll(probes[0], timeout)]
+    results = [None] * len(probes)
+    failures = []
+
+    def run(index, probe):
+        try:
+            results[index] = _poll(probe, timeout)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=run, args=(index, probe))
+               for index, probe in enumerate(probes)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+    return results
+
+
+def _poll(probe, timeout):
+    deadline = time.time() + (probe.timeout or timeout)
+    delay = constants.READINESS_INITIAL_DELAY
+    last_error = None
+    while True:
+        try:
+            result = probe.check()
+            if result:
+                return result
+        except probe.errors as e:
+            last_error = e
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            message = 'Timed out waiting for {}'.format(probe)
+            if last_error:
+                message = '{}: {}'.format(message, last_error)
+            raise NotReadyError(message)
+        # with jitter, but never more than the cap past the ready moment
+        time.sleep(min(delay * random.uniform(0.5, 1.5),
+                       constants.READINESS_MAX_DELAY, remaining))
+        delay = min(delay * 2, constants.READINESS_MAX_DELAY)
@@ -0,0 +1,220 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from path import path
+
+from docl.logs import logger
+
+
+class JsonStore(object):
+    """A JSON object stored in a file that is rewritten atomically
+
+    Read-modify-write cycles are serialized between processes with a lock
+    file next to it.
+    """
+
+    def __init__(self, store_path):
+        self.path = path(store_path)
+        self._lock_path = path('{}.lock'.format(self.path))
+        self._cache = None
+        self._cache_key = None
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return {}
+        key = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if key != self._cache_key:
+            self._cache = json.loads(self.path.text() or '{}')
+            self._cache_key = key
+        return self._cache
+
+    def _write(self, items):
+        tmp_path = path('{}.{}.tmp'.format(self.path, os.getpid()))
+        tmp_path.write_text(json.dumps(items, indent=2, sort_keys=True))
+        os.rename(tmp_path, self.path)
+        self._cache_key = None
+
+    @contextmanager
+    def _modify(self):
+        with self._locked():
+            items = dict(self._read())
+            yield items
+            self._write(items)
+
+
+class Registry(JsonStore):
+    """Containers created by docl
+
+    Each record holds the container id, name, ip, image, labels, creation
+    time, mounts and the arguments it was started with. Records are indexed
+    by id; names and id prefixes can be used for lookups as well.
+    """
+
+    def add(self, container_id, ip, name=None, image=None, labels=None,
+            mounts=None, **extra):
+        record = dict(extra)
+        record.update({
+            'id': container_id,
+            'name': name,
+            'ip': ip,
+            'image': image,
+            'labels': labels_dict(labels),
+            'mounts': list(mounts or []),
+            'created': time.time(),
+        })
+        with self._modify() as containers:
+            containers[container_id] = record
+        return record
+
+    def update(self, container_id, **fields):
+        with self._modify() as containers:
+            record = containers.get(container_id)
+            if record:
+                record = dict(record)
+                record.update(fields)
+                containers[container_id] = record
+        return record
+
+    def claim(self, predicate, **fields):
+        """Atomically update the oldest record matching `predicate` with
+        `fields` and return it, or None if nothing matches"""
+        with self._modify() as containers:
+            candidates = sorted((c for c in containers.values()
+                                 if predicate(c)),
+                                key=lambda c: c['created'])
+            if not candidates:
+                return None
+            record = dict(candidates[0])
+            record.update(fields)
+            containers[record['id']] = record
+        return record
+
+    def remove(self, container_id):
+        with self._modify() as containers:
+            record = self._lookup(containers, container_id)
+            if record:
+                del containers[record['id']]
+        return record
+
+    def get(self, id_or_name):
+        """Return the record of a container by id, id prefix or name"""
+        return self._lookup(self._read(), id_or_name)
+
+    @staticmethod
+    def _lookup(containers, id_or_name):
+        if not id_or_name:
+            return None
+        if id_or_name in containers:
+            return containers[id_or_name]
+        matches = [c for c in containers.values()
+                   if c['id'].startswith(id_or_name) or
+                   c.get('name') == id_or_name]
+        return matches[0] if len(matches) == 1 else None
+
+    def find(self, labels=None, name=None):
+        """Records matching all `labels` (`key=value` strings) and `name`,
+        oldest first"""
+        wanted = labels_dict(labels)
+        result = []
+        for record in self.all():
+            if name and record.get('name') != name:
+                continue
+            record_labels = record.get('labels') or {}
+            if any(record_labels.get(k) != v for k, v in wanted.items()):
+                continue
+            result.append(record)
+        return result
+
+    def all(self):
+        return sorted(self._read().values(), key=lambda c: c['created'])
+
+    def latest(self):
+        """The last container started, ignoring warm pool standbys"""
+        containers = [c for c in self.all() if not c.get('standby')]
+        return containers[-1] if containers else None
+
+    def retain(self, container_ids):
+        """Drop every record whose id is not in `container_ids`"""
+        container_ids = set(container_ids)
+        with self._modify() as containers:
+            for container_id in list(containers):
+                if container_id not in container_ids:
+                    del containers[container_id]
+
+
+class EventsSync(threading.Thread):
+    """Keeps a registry in sync with the docker events stream
+
+    Records are dropped when their container is destroyed, marked as not
+    running when it stops or dies, and their IP is refreshed when the
+    container is (re)started.
+    """
+
+    def __init__(self, registry, events, inspect_ip):
+        super(EventsSync, self).__init__(name='docl-registry-sync')
+        self.daemon = True
+        self.registry = registry
+        self._events = events
+        self._inspect_ip = inspect_ip
+
+    def run(self):
+        try:
+            for event in self._events():
+                self.handle(event)
+        except Exception as e:
+            logger.warning('Container registry sync stopped: {}'.format(e))
+
+    def handle(self, event):
+        container_id = event.get('id')
+        record = self.registry.get(container_id)
+        if not record:
+            return
+        status = event.get('status') or event.get('Action')
+        if status == 'destroy':
+            self.registry.remove(container_id)
+        elif status in ('die', 'stop'):
+            self.registry.update(record['id'], running=False)
+        elif status == 'start':
+            self.registry.update(record['id'], running=True,
+                                 ip=self._inspect_ip(record['id']))
+
+
+def labels_dict(labels):
+    if isinstance(labels, dict):
+        return dict(labels)
+    result = {}
+    for label in labels or []:
+        key, _, value = label.partition('=')
+        result[key] = value
+    return result
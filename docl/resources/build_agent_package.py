@@ -0,0 +1,164 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Incrementally rebuild the agent package from the agent template.
+
+Runs inside the manager container. The package is a tar archive written as
+a sequence of gzip members - a valid .tar.gz for gzip, tar and python's
+tarfile. Each file contributes a member for its tar header and a member
+for its padded content. Content members are cached by content hash, so
+only files whose content changed are compressed again, and compression
+runs in a thread pool (zlib releases the GIL).
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import zlib
+from multiprocessing.pool import ThreadPool
+
+COMPRESS_LEVEL = 6
+
+
+def _gzip_member(data):
+    # wbits=31 produces a gzip member (with a zero mtime, so members are
+    # reproducible)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _sha1(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _padded(data):
+    remainder = len(data) % tarfile.BLOCKSIZE
+    if remainder:
+        data += b'\0' * (tarfile.BLOCKSIZE - remainder)
+    return data
+
+
+def _walk(template_dir):
+    """(path, arcname) of the template dir and everything in it, in the
+    order tar would add them"""
+    parent = os.path.dirname(template_dir.rstrip('/'))
+    for root, dirs, files in os.walk(template_dir):
+        dirs.sort()
+        yield root, os.path.relpath(root, parent)
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            yield file_path, os.path.relpath(file_path, parent)
+        # os.walk does not descend into symlinked dirs; tar stores the link
+        for name in dirs:
+            dir_path = os.path.join(root, name)
+            if os.path.islink(dir_path):
+                yield dir_path, os.path.relpath(dir_path, parent)
+
+
+def _load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def build(template_dir, package_path, cache_dir, workers):
+    content_dir = os.path.join(cache_dir, 'content')
+    if not os.path.isdir(content_dir):
+        os.makedirs(content_dir)
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    old_manifest = _load_manifest(manifest_path)
+    manifest = {}
+    # gettarinfo needs an archive to track hard links and owner names
+    archive = tarfile.open(fileobj=io.BytesIO(), mode='w',
+                           format=tarfile.GNU_FORMAT)
+    entries = []
+    to_compress = {}
+    for file_path, arcname in _walk(template_dir):
+        info = archive.gettarinfo(file_path, arcname)
+        digest = None
+        if info.isreg():
+            stat = os.stat(file_path)
+            key = [stat.st_mtime, stat.st_size, stat.st_ino]
+            previous = old_manifest.get(arcname)
+            if previous and previous['key'] == key:
+                digest = previous['sha1']
+            else:
+                digest = _sha1(file_path)
+            manifest[arcname] = {'key': key, 'sha1': digest}
+            member_path = os.path.join(content_dir, digest + '.gz')
+            if not os.path.exists(member_path):
+                to_compress[digest] = (file_path, member_path)
+        entries.append((info.tobuf(format=tarfile.GNU_FORMAT), digest))
+
+    def compress(item):
+        file_path, member_path = item
+        with open(file_path, 'rb') as f:
+            member = _gzip_member(_padded(f.read()))
+        tmp_path = '{}.{}'.format(member_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(member)
+        os.rename(tmp_path, member_path)
+
+    pool = ThreadPool(workers)
+    try:
+        pool.map(compress, to_compress.values())
+    finally:
+        pool.close()
+        pool.join()
+
+    tmp_package_path = '{}.tmp'.format(package_path)
+    used = set()
+    with open(tmp_package_path, 'wb') as out:
+        for header, digest in entries:
+            out.write(_gzip_member(header))
+            if digest:
+                used.add(digest + '.gz')
+                with open(os.path.join(content_dir, digest + '.gz'),
+                          'rb') as member:
+                    out.write(member.read())
+        # end of archive marker, padded to a full record like tar does
+        out.write(_gzip_member(b'\0' * tarfile.RECORDSIZE))
+    os.rename(tmp_package_path, package_path)
+
+    for name in os.listdir(content_dir):
+        if name not in used:
+            os.remove(os.path.join(content_dir, name))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    return len(to_compress), len(manifest)
+
+
+def main():
+    params = json.loads(base64.b64decode(sys.argv[1]).decode('utf-8'))
+    compressed, total = build(params['agent_template_dir'],
+                              params['agent_package_path'],
+                              params['cache_dir'],
+                              params['workers'])
+    sys.stdout.write('Compressed {} of {} files\n'.format(compressed, total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import time
+
+import argh
+
+from docl import constants
+from docl import readiness
+from docl.logs import logger
+from docl.subprocess import quiet_docker
+from docl.tracing import span
+
+
+def plan(services, order=None):
+    """Split `services` into stages that can restart together.
+
+    `order` maps a service to the services that have to be restarted (and
+    active) before it. Constraints on services that are not being restarted
+    are ignored.
+    """
+    services = set(services)
+    order = order or {}
+    after = dict((s, set(order.get(s) or ()) & services) for s in services)
+    stages = []
+    while after:
+        stage = sorted(s for s, deps in after.items() if not deps)
+        if not stage:
+            raise argh.CommandError(
+                'Circular service_order between: {}'
+                .format(', '.join(sorted(after))))
+        stages.append(stage)
+        for service in stage:
+            del after[service]
+        for deps in after.values():
+            deps.difference_update(stage)
+    return stages
+
+
+def restart(container_id, services, order=None, reload=None,
+            timeout=constants.SERVICE_RESTART_TIMEOUT, interrupted=None,
+            timings=None):
+    """Restart `services` stage by stage, one systemctl call per stage.
+
+    Services with a strategy in `reload` are reloaded in place instead (see
+    `reload_service`). Each stage waits until all of its units are active
+    again. If `interrupted()` becomes true between stages, the services of
+    the remaining stages are returned instead of restarted.
+
+    If a `timings` dict is given, it is filled with the time each service's
+    restart was issued and the time it was seen active again. A reloaded
+    unit stays active throughout its reload, so its entry is marked
+    `reloaded`: its active time does not tell when it is serving again.
+    """
+    reload = reload or {}
+    stages = plan(services, order)
+    while stages:
+        if interrupted and interrupted():
+            return [s for stage in stages for s in stage]
+        _restart_stage(container_id, stages.pop(0), reload, timeout,
+                       timings if timings is not None else {})
+    return []
+
+
+def reload_service(container_id, service, strategy):
+    """Apply a reload strategy: {'signal': NAME} sends the signal to the
+    unit's main process, {'command': SHELL_COMMAND} runs the command in the
+    container"""
+    strategy_type = isinstance(strategy, dict) and \
+        next((k for k in ('signal', 'command') if k in strategy), None)
+    if strategy_type == 'signal':
+        quiet_docker('exec', container_id, 'systemctl', 'kill',
+                     '--kill-who=main',
+                     '--signal={}'.format(strategy['signal']), service)
+    elif strategy_type == 'command':
+        quiet_docker('exec', container_id, 'sh', '-c', strategy['command'])
+    else:
+        raise argh.CommandError(
+            'Invalid service_reload strategy for {}: {}. Expected a '
+            '"signal" or "command" key'.format(service, strategy))
+
+
+def _restart_stage(container_id, stage, reload, timeout, timings):
+    reloaded = [s for s in stage if s in reload]
+    restarted = [s for s in stage if s not in reload]
+    start = time.time()
+    with span('restart {}'.format(' '.join(stage))):
+        for service in reloaded:
+            logger.info('Reloading {}'.format(service))
+            reload_service(container_id, service, reload[service])
+        if restarted:
+            logger.info('Restarting {}'.format(', '.join(restarted)))
+            quiet_docker('exec', container_id, 'systemctl', 'restart',
+                         *restarted)
+        active_times = readiness.wait(
+            [_ActiveUnitProbe(container_id, service) for service in stage],
+            timeout=timeout)
+    for service, active_time in zip(stage, active_times):
+        if service in reload:
+            logger.info('{} reloaded after {:.1f}s (readiness not verified)'
+                        .format(service, active_time - start))
+        else:
+            logger.info('{} active after {:.1f}s'.format(
+                service, active_time - start))
+        timings[service] = {'issued': start, 'active': active_time,
+                            'reloaded': service in reload}
+
+
+class _ActiveUnitProbe(readiness.SystemdUnitProbe):
+    """Returns the time at which the unit was seen active"""
+
+    def check(self):
+        super(_ActiveUnitProbe, self).check()
+        return time.time()
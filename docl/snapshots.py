@@ -0,0 +1,86 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import time
+
+from docl import constants
+from docl.registry import JsonStore
+
+
+class Snapshots(JsonStore):
+    """Snapshot images of manager containers, keyed by snapshot name
+
+    Each record holds the snapshot image, its size, the container it was
+    taken from with the arguments that container was started with, and
+    when the snapshot was created and last restored.
+    """
+
+    def add(self, name, image, size, container):
+        now = time.time()
+        record = {
+            'name': name,
+            'image': image,
+            'size': size,
+            'created': now,
+            'last_used': now,
+            'container_id': container['id'],
+            'container_name': container.get('name'),
+            'source_image': container.get('image'),
+            'labels': container.get('labels') or {},
+            'mounts': container.get('mounts') or [],
+            'run_args': container.get('run_args'),
+        }
+        with self._modify() as snapshots:
+            snapshots[name] = record
+        return record
+
+    def get(self, name):
+        return self._read().get(name)
+
+    def touch(self, name, **fields):
+        fields['last_used'] = time.time()
+        with self._modify() as snapshots:
+            record = dict(snapshots[name])
+            record.update(fields)
+            snapshots[name] = record
+        return record
+
+    def remove(self, name):
+        with self._modify() as snapshots:
+            return snapshots.pop(name, None)
+
+    def all(self):
+        """Snapshots, least recently used first"""
+        return sorted(self._read().values(), key=lambda s: s['last_used'])
+
+    def over_budget(self, budget, keep=None):
+        """Least recently used snapshots to evict so the rest fit `budget`
+        bytes. The `keep` snapshot is never evicted."""
+        snapshots = self.all()
+        total = sum(s['size'] for s in snapshots)
+        evict = []
+        for snapshot in snapshots:
+            if total <= budget:
+                break
+            if snapshot['name'] == keep:
+                continue
+            evict.append(snapshot)
+            total -= snapshot['size']
+        return evict
+
+
+def image_tag(name):
+    return '{}:{}'.format(constants.SNAPSHOT_IMAGE_REPOSITORY, name)
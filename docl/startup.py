@@ -0,0 +1,70 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Measure how long the CLI takes to get to a command.
+
+Each measurement runs in a fresh interpreter, which imports docl and parses
+the command line up to the command's --help, and reports the time that took
+and which of the modules that should only load on demand got imported.
+"""
+
+import json
+import sys
+
+import argh
+import sh
+
+from docl import constants
+
+_PROBE = '''
+import json, os, sys, time
+start = time.time()
+from docl.main import dispatch
+stdout = sys.stdout
+sys.stdout = open(os.devnull, 'w')
+try:
+    dispatch([sys.argv[1], '--help'])
+except SystemExit as e:
+    # --help exits with 0, an unknown command with an argparse error
+    if e.code:
+        sys.stdout = stdout
+        raise
+elapsed = time.time() - start
+sys.stdout = stdout
+sys.stdout.write(json.dumps({
+    'time': elapsed,
+    'modules': sorted(m for m in sys.modules if sys.modules[m] is not None),
+}))
+'''
+
+
+def measure(command_name, runs):
+    """(fastest startup time in seconds, heavy modules imported) of
+    `command_name` over `runs` runs"""
+    times = []
+    heavy = set()
+    for _ in range(runs):
+        try:
+            output = sh.Command(sys.executable)('-c', _PROBE, command_name)
+        except sh.ErrorReturnCode as e:
+            raise argh.CommandError('Failed starting {}: {}'.format(
+                command_name,
+                e.stderr.decode('utf-8', 'replace').strip().split('\n')[-1]))
+        result = json.loads(str(output))
+        times.append(result['time'])
+        heavy.update(m for m in result['modules']
+                     if m in constants.STARTUP_HEAVY_MODULES)
+    return min(times), sorted(heavy)
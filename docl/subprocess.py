@@ -18,12 +18,16 @@ from __future__ import absolute_import
 
 import subprocess
 import functools
+import json
+import os
 import sys
 
 import proxy_tools
 import sh
 
+from docl import docker_api
 from docl.configuration import configuration
+from docl.tracing import TracedCommand
 
 
 def bake(cmd):
@@ -33,19 +37,70 @@ def bake(cmd):
 
 
 def docker_proxy(quiet=False):
-    result = sh.docker.bake('-H', configuration.docker_host)
+    docker_host = configuration.docker_host
+    result = sh.docker.bake('-H', docker_host)
     if not quiet:
         result = bake(result)
-    return result
+    elif (configuration.docker_backend == 'api' and
+          docker_api.supports(docker_host)):
+        # calls the Engine API can't serve fall back to the CLI
+        result = docker_api.ApiDocker(docker_api.client(docker_host),
+                                      fallback=result)
+    return TracedCommand(result, 'docker')
+
+
+def _lazy(factory):
+    # resolve commands on first use rather than on import, so commands that
+    # don't need them don't pay for the lookup (or fail if they're missing)
+    cache = []
+
+    def get():
+        if not cache:
+            cache.append(factory())
+        return cache[0]
+    return proxy_tools.Proxy(get)
 
 
 docker = proxy_tools.Proxy(docker_proxy)
 quiet_docker = proxy_tools.Proxy(functools.partial(docker_proxy, quiet=True))
-ssh_keygen = sh.Command('ssh-keygen')
-ssh_keyscan = sh.Command('ssh-keyscan')
-cfy = bake(sh.cfy)
-serve = sh.serve
-gzip = sh.gzip.bake(_tty_out=False)
+ssh_keygen = _lazy(lambda: TracedCommand(sh.Command('ssh-keygen'),
+                                         'ssh-keygen'))
+ssh_keyscan = _lazy(lambda: TracedCommand(sh.Command('ssh-keyscan'),
+                                          'ssh-keyscan'))
+cfy = _lazy(lambda: TracedCommand(bake(sh.cfy), 'cfy'))
+serve = _lazy(lambda: TracedCommand(sh.serve, 'serve'))
+
+
+def docker_events(filters=None):
+    """Yield docker events (as dicts) until the stream is closed"""
+    docker_host = configuration.docker_host
+    if (configuration.docker_backend == 'api' and
+            docker_api.supports(docker_host)):
+        for event in docker_api.client(docker_host).events(filters=filters):
+            yield event
+        return
+    args = ['events', '--format', '{{json .}}']
+    for name, values in (filters or {}).items():
+        args += ['--filter={}={}'.format(name, v) for v in values]
+    for line in sh.docker('-H', docker_host, *args, _iter=True):
+        if line.strip():
+            yield json.loads(line)
+
+
+def docker_stream(*args):
+    """Start a docker CLI process whose binary output is read from its
+    stdout pipe"""
+    return subprocess.Popen(['docker', '-H', configuration.docker_host] +
+                            list(args), stdout=subprocess.PIPE)
+
+
+def spawn_detached(args, log_path, env=None):
+    """Start a process that outlives docl, logging its output to
+    `log_path`"""
+    with open(log_path, 'a') as log:
+        subprocess.Popen(args, stdin=open(os.devnull), stdout=log,
+                         stderr=subprocess.STDOUT, close_fds=True,
+                         preexec_fn=os.setsid, env=env)
 
 
 def ssh(ip, keypath):
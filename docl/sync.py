@@ -0,0 +1,139 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+"""Copy source trees into containers when they can't be bind mounted.
+
+The container keeps a manifest of the content hash of every file synced to
+it, so each sync only sends the files whose hash differs as one gzipped tar
+stream, and removes the files that are gone from the host.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+import sh
+
+from docl import constants
+from docl import docker_api
+from docl.configuration import configuration
+from docl.registry import JsonStore
+from docl.subprocess import quiet_docker
+from docl.watching import PathFilter
+
+
+class HashCache(JsonStore):
+    """Content hashes of host files, keyed by path. A file is only hashed
+    again when its mtime or size changed."""
+
+    def hashes(self, files):
+        """{key: (file path, sha1)} of (file path, key) pairs"""
+        cached = self._read()
+        updated = {}
+        hashes = {}
+        for file_path, key in files:
+            stat = os.stat(file_path)
+            stat_key = [stat.st_mtime, stat.st_size]
+            entry = cached.get(file_path)
+            if not entry or entry[:2] != stat_key:
+                entry = stat_key + [_sha1(file_path)]
+                updated[file_path] = entry
+            hashes[key] = (file_path, entry[2])
+        if updated:
+            with self._modify() as cache:
+                cache.update(updated)
+        return hashes
+
+
+def push(container_id, mappings, hash_cache):
+    """Sync `mappings`, a list of (host path, container path) pairs, into
+    the container. Returns the container paths written and removed."""
+    path_filter = PathFilter(None, constants.SYNC_EXCLUDE)
+    files = []
+    for src, dst in mappings:
+        if os.path.isfile(src):
+            files.append((src, dst))
+        else:
+            files.extend((file_path, os.path.join(dst, relative_path))
+                         for file_path, relative_path
+                         in _files(src, path_filter))
+    local = hash_cache.hashes(files)
+    remote = _remote_manifest(container_id)
+    changed = sorted(p for p, (_, digest) in local.items()
+                     if remote.get(p) != digest)
+    removed = sorted(p for p in remote if p not in local)
+    if changed or removed or not remote:
+        manifest = dict((p, digest) for p, (_, digest) in local.items())
+        _send(container_id, _archive(
+            [(local[p][0], p) for p in changed], manifest))
+    if removed:
+        quiet_docker('exec', container_id, 'rm', '-f', *removed)
+    return changed, removed
+
+
+def _files(root, path_filter):
+    for dir_path, dirs, files in os.walk(root):
+        relative_dir = os.path.relpath(dir_path, root)
+        if relative_dir != '.' and path_filter and \
+                path_filter.excludes(relative_dir):
+            dirs[:] = []
+            continue
+        for name in files:
+            relative_path = os.path.normpath(os.path.join(relative_dir, name))
+            if path_filter and not path_filter.accepts(relative_path):
+                continue
+            yield os.path.join(dir_path, name), relative_path
+
+
+def _sha1(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(constants.BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _remote_manifest(container_id):
+    try:
+        return json.loads(str(quiet_docker(
+            'exec', container_id, 'cat', constants.SYNC_MANIFEST_PATH)))
+    except (sh.ErrorReturnCode, ValueError):
+        return {}
+
+
+def _archive(files, manifest):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w:gz') as tar:
+        for src, dst in files:
+            tar.add(src, arcname=dst.lstrip('/'), recursive=False)
+        manifest_data = json.dumps(manifest).encode('utf-8')
+        info = tarfile.TarInfo(constants.SYNC_MANIFEST_PATH.lstrip('/'))
+        info.size = len(manifest_data)
+        tar.addfile(info, io.BytesIO(manifest_data))
+    return data.getvalue()
+
+
+def _send(container_id, data):
+    docker_host = configuration.docker_host
+    if configuration.docker_backend == 'api' and \
+            docker_api.supports(docker_host):
+        # the archive endpoint extracts gzipped tar streams as well
+        docker_api.client(docker_host).put_archive(container_id, '/', data)
+    else:
+        quiet_docker('exec', '-i', container_id, 'tar', 'xzf', '-', '-C', '/',
+                     _in=data)
@@ -0,0 +1,118 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from path import path
+
+
+class Tracer(object):
+    """Collects timed spans of docl phases and external commands"""
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name, category='phase', **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.time(), category, **args)
+
+    def record(self, name, start, end, category='phase', **args):
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int((end - start) * 1e6),
+                'pid': os.getpid(),
+                'tid': threading.current_thread().ident,
+                'args': args,
+            })
+
+    def write_chrome_trace(self, output_path):
+        with self._lock:
+            spans = list(self.spans)
+        path(output_path).write_text(json.dumps({
+            'traceEvents': spans,
+            'displayTimeUnit': 'ms'
+        }))
+
+    def summary(self):
+        """Lines of a table of spans aggregated by name, slowest first"""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                key = (span['cat'], span['name'])
+                count, total, longest = totals.get(key, (0, 0, 0))
+                totals[key] = (count + 1, total + span['dur'],
+                               max(longest, span['dur']))
+        rows = sorted(totals.items(), key=lambda item: -item[1][1])
+        width = max([len(name) for (_, name), _ in rows] + [4])
+        lines = ['{:<{w}}  {:<7}  {:>5}  {:>9}  {:>9}'.format(
+            'span', 'type', 'count', 'total [s]', 'max [s]', w=width)]
+        for (category, name), (count, total, longest) in rows:
+            lines.append('{:<{w}}  {:<7}  {:>5}  {:>9.2f}  {:>9.2f}'.format(
+                name, category, count, total / 1e6, longest / 1e6,
+                w=width))
+        return lines
+
+
+class TracedCommand(object):
+    """Wraps an sh command (or anything called like one) so each call is
+    recorded as a span"""
+
+    def __init__(self, cmd, name):
+        self._cmd = cmd
+        self._name = name
+
+    def __call__(self, *args, **kwargs):
+        if not tracer.enabled:
+            return self._cmd(*args, **kwargs)
+        name = self._name
+        if args and self._name == 'docker' and \
+                not str(args[0]).startswith('-'):
+            name = '{} {}'.format(self._name, args[0])
+        with tracer.span(name, category='command'):
+            return self._cmd(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._cmd, name)
+        if name == 'bake' or not callable(attr):
+            return attr
+        return TracedCommand(attr, '{} {}'.format(self._name, name))
+
+    def __str__(self):
+        return str(self._cmd)
+
+
+tracer = Tracer()
+span = tracer.span
@@ -0,0 +1,326 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import fnmatch
+import os
+import re
+import threading
+import time
+
+
+class PackageIndex(object):
+    """Maps changed source files to the services that load them.
+
+    Package source directories are stored in a trie keyed by path
+    component, so resolving a path costs one dict lookup per component
+    regardless of how many packages are watched.
+    """
+
+    _SERVICES = object()
+
+    def __init__(self, source_root, package_dir, package_services):
+        self._root = {}
+        self.package_paths = {}
+        for package, services in package_services.items():
+            package_path = os.path.join(source_root, package_dir[package],
+                                        package)
+            package_path = os.path.normpath(package_path)
+            self.package_paths[package] = package_path
+            node = self._root
+            for part in _split(package_path):
+                node = node.setdefault(part, {})
+            node[self._SERVICES] = (package, package_path, set(services))
+
+    def resolve(self, file_path):
+        """Return (package, package_path, services) of the innermost package
+        containing `file_path`, or None"""
+        node = self._root
+        match = None
+        for part in _split(os.path.normpath(file_path)):
+            node = node.get(part)
+            if node is None:
+                break
+            match = node.get(self._SERVICES, match)
+        return match
+
+
+class PathFilter(object):
+    """Include/exclude glob rules for changed files.
+
+    Include patterns are matched against the file name. Exclude patterns are
+    matched against every component of the path relative to its package, as
+    well as against the relative path itself, so "tests" ignores any tests
+    directory and "*/migrations/*" ignores a nested one.
+    """
+
+    def __init__(self, include, exclude):
+        self.include = tuple(include or ())
+        self.exclude = tuple(exclude or ())
+        self._include = _glob_regex(self.include)
+        self._exclude = _glob_regex(self.exclude)
+
+    def accepts(self, relative_path):
+        parts = _split(relative_path)
+        if not parts or self.excludes(relative_path):
+            return False
+        return not self._include or bool(self._include.match(parts[-1]))
+
+    def excludes(self, relative_path):
+        """Whether the file or directory at `relative_path` is excluded"""
+        if not self._exclude:
+            return False
+        return any(self._exclude.match(p)
+                   for p in [relative_path] + _split(relative_path))
+
+
+def changed_services(index, path_filter, file_path):
+    """Services to restart for a change of `file_path`, or an empty set"""
+    match = index.resolve(file_path)
+    if not match:
+        return set()
+    _, package_path, services = match
+    if not path_filter.accepts(os.path.relpath(file_path, package_path)):
+        return set()
+    return services
+
+
+def event_paths(event):
+    """Changed file paths of a watchdog event; directory events are
+    ignored since the files inside them raise their own events"""
+    if event.is_directory:
+        return []
+    paths = [event.src_path]
+    dest_path = getattr(event, 'dest_path', None)
+    if dest_path:
+        paths.append(dest_path)
+    return paths
+
+
+def _glob_regex(patterns):
+    """A single regex matching any of the glob `patterns`"""
+    if not patterns:
+        return None
+    return re.compile('|'.join('(?:{})'.format(fnmatch.translate(p))
+                               for p in patterns))
+
+
+def _split(file_path):
+    return [p for p in file_path.split(os.sep) if p and p != '.']
+
+
+class Debouncer(object):
+    """Collects changed items and hands them to `action` in batches.
+
+    A batch is handed over once no new items arrived for `quiet_period`
+    seconds, or `max_wait` seconds after its first item so a steady stream
+    of changes still gets processed. `action(items, interrupted, detected)`
+    gets the time the first change of the batch was seen as `detected`. It
+    should check `interrupted()` between items and return the items it did
+    not get to; they are queued again together with the newer changes.
+    """
+
+    def __init__(self, action, quiet_period, max_wait):
+        self.action = action
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        self._pending = set()
+        self._first = None
+        self._last = None
+        self._detected = None
+        self._stopped = False
+        self._cond = threading.Condition()
+
+    def add(self, items):
+        items = set(items)
+        if not items:
+            return
+        with self._cond:
+            now = time.time()
+            self._pending.update(items)
+            self._last = now
+            if self._first is None:
+                self._first = now
+            if self._detected is None:
+                self._detected = now
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self):
+        """Process batches until stop() is called"""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch, detected = batch
+            remaining = self.action(batch, self._interrupted, detected)
+            if remaining:
+                with self._cond:
+                    self._pending.update(remaining)
+                    if self._first is None:
+                        self._first = self._last = time.time()
+                    # postponed changes keep their detection time
+                    self._detected = min(self._detected or detected,
+                                         detected)
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                if not self._pending:
+                    # waiting with a timeout keeps the main thread
+                    # responsive to KeyboardInterrupt on python 2
+                    self._cond.wait(1)
+                    continue
+                now = time.time()
+                deadline = min(self._last + self.quiet_period,
+                               self._first + self.max_wait)
+                if now >= deadline:
+                    break
+                self._cond.wait(min(deadline - now, 1))
+            batch = self._pending, self._detected
+            self._pending = set()
+            self._first = self._last = self._detected = None
+            return batch
+
+    def _interrupted(self):
+        with self._cond:
+            return bool(self._pending) or self._stopped
+
+
+class Poller(object):
+    """Detects changed files by polling, for file systems that don't
+    deliver inotify events (NFS, sshfs, some VM shared folders).
+
+    An index of (mtime, size, inode) per file and of the entries of each
+    directory is kept in memory. A directory is only listed again when its
+    mtime changed, which is when files were added, removed or renamed in
+    it; otherwise only its known files are stat'ed. Editing a file in place
+    does not change its directory's mtime, so files can't be skipped.
+    Excluded directories and files that are not included are not indexed.
+    """
+
+    def __init__(self, roots, callback, path_filter, interval):
+        self.roots = list(roots)
+        self.callback = callback
+        self.path_filter = path_filter
+        self.interval = interval
+        # dir path -> (dir mtime, {file name: stat key}, [subdir names])
+        self._index = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for root in self.roots:
+            self._scan(root, '', [], report=False)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def poll(self):
+        """Return the paths of files created, modified or removed since the
+        last poll"""
+        changed = []
+        for root in self.roots:
+            self._scan(root, '', changed, report=True)
+        return changed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            changed = self.poll()
+            if changed:
+                self.callback(changed)
+
+    def _scan(self, dir_path, relative_dir, changed, report):
+        try:
+            dir_mtime = os.stat(dir_path).st_mtime
+        except OSError:
+            self._forget(dir_path, changed)
+            return
+        cached = self._index.get(dir_path)
+        if cached and cached[0] == dir_mtime:
+            _, old_files, subdirs = cached
+            files = {}
+            for name, old_key in old_files.items():
+                file_path = os.path.join(dir_path, name)
+                try:
+                    files[name] = _stat_key(os.stat(file_path))
+                except OSError:
+                    changed.append(file_path)
+                    continue
+                if files[name] != old_key:
+                    changed.append(file_path)
+        else:
+            old_files, old_subdirs = ({}, []) if not cached else cached[1:]
+            files, subdirs = self._list(dir_path, relative_dir)
+            if report:
+                changed.extend(
+                    os.path.join(dir_path, name)
+                    for name in set(files) | set(old_files)
+                    if files.get(name) != old_files.get(name))
+            for name in set(old_subdirs) - set(subdirs):
+                self._forget(os.path.join(dir_path, name), changed)
+        self._index[dir_path] = (dir_mtime, files, subdirs)
+        for name in subdirs:
+            self._scan(os.path.join(dir_path, name),
+                       os.path.join(relative_dir, name), changed, report)
+
+    def _list(self, dir_path, relative_dir):
+        files = {}
+        subdirs = []
+        try:
+            entries = list(_scandir(dir_path))
+        except OSError:
+            return files, subdirs
+        for entry in entries:
+            relative_path = os.path.join(relative_dir, entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.path_filter.excludes(relative_path):
+                        subdirs.append(entry.name)
+                elif self.path_filter.accepts(relative_path):
+                    files[entry.name] = _stat_key(entry.stat())
+            except OSError:
+                continue
+        return files, subdirs
+
+    def _forget(self, dir_path, changed):
+        cached = self._index.pop(dir_path, None)
+        if not cached:
+            return
+        _, files, subdirs = cached
+        changed.extend(os.path.join(dir_path, name) for name in files)
+        for name in subdirs:
+            self._forget(os.path.join(dir_path, name), changed)
+
+
+def _stat_key(stat):
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+def _scandir(dir_path):
+    try:
+        scandir = os.scandir
+    except AttributeError:
+        from scandir import scandir
+    return scandir(dir_path)
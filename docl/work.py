@@ -14,11 +14,20 @@
 # limitations under the License.
 ############
 
+import argh
+
 from docl.configuration import configuration
+from docl.image_cache import ImageCache
+from docl.registry import Registry
+from docl.snapshots import Snapshots
+from docl.sync import HashCache
 
 
 class Work(object):
 
+    def __init__(self):
+        self._registry = None
+
     def init(self):
         if not self.dir.exists():
             self.dir.makedirs()
@@ -27,24 +36,103 @@ class Work(object):
     def dir(self):
         return configuration.workdir
 
+    @property
+    def registry(self):
+        registry_path = self.dir / 'containers.json'
+        if self._registry is None or self._registry.path != registry_path:
+            self._registry = Registry(registry_path)
+            self._import_legacy_container(self._registry)
+        return self._registry
+
+    def _import_legacy_container(self, registry):
+        """Register the container recorded by older docl versions in the
+        last_container_id and last_container_ip files"""
+        id_path = self.dir / 'last_container_id'
+        ip_path = self.dir / 'last_container_ip'
+        if not id_path.exists():
+            return
+        container_id = id_path.text().strip()
+        if container_id and not registry.get(container_id):
+            registry.add(container_id=container_id,
+                         ip=ip_path.text().strip() if ip_path.exists()
+                         else None)
+        for legacy_path in (id_path, ip_path):
+            if legacy_path.exists():
+                legacy_path.remove()
+
+    @property
+    def snapshots(self):
+        return Snapshots(self.dir / 'snapshots.json')
+
+    @property
+    def sync_hashes(self):
+        return HashCache(self.dir / 'sync-hashes.json')
+
+    def container_id(self, container_id=None):
+        """Resolve a container id, id prefix or name known to the registry,
+        defaulting to the last container started"""
+        if not container_id:
+            return self.last_container_id
+        container = self.registry.get(container_id)
+        return container['id'] if container else container_id
+
+    def container_ip(self, container_id=None):
+        """The registered IP of a container, or None if it is unknown"""
+        if not container_id:
+            return self.last_container_ip
+        container = self.registry.get(container_id)
+        return container['ip'] if container else None
+
+    @property
+    def last_container(self):
+        container = self.registry.latest()
+        if not container:
+            raise argh.CommandError('No containers started by docl. '
+                                    'Run "docl run"')
+        return container
+
     @property
     def last_container_id(self):
-        return (self.dir / 'last_container_id').text()
+        return self.last_container['id']
 
     @property
     def last_container_ip(self):
-        return (self.dir / 'last_container_ip').text()
+        return self.last_container['ip']
 
     @property
     def cached_install_rpm_path(self):
         return self.dir / 'cloudify-manager-install.rpm'
 
     @property
-    def pulled_image_path(self):
-        return self.dir / 'manager-image.tar.gz'
+    def image_cache(self):
+        image_cache = ImageCache(self.dir / 'image-cache')
+        self._import_legacy_image(image_cache)
+        return image_cache
+
+    def _import_legacy_image(self, image_cache):
+        """Move the image older docl versions downloaded to
+        manager-image.tar.gz into the image cache, under the commit it was
+        pulled for. An image that is partial, already cached or was not
+        loaded (older versions recorded the commit after loading it) is
+        removed."""
+        image_path = self.dir / 'manager-image.tar.gz'
+        state_path = self.dir / 'manager-image.tar.gz.download'
+        sha1_path = self.dir / 'pulled_image.sha1'
+        if not image_path.exists():
+            return
+        key = self.last_pulled_image_commit_sha1
+        if key and not state_path.exists() and \
+                image_path.mtime <= sha1_path.mtime and \
+                not image_cache.get(key):
+            image_path.rename(image_cache.file_path(key))
+            image_cache.add(key, configuration.manager_image_url)
+        for legacy_path in (image_path, state_path):
+            if legacy_path.exists():
+                legacy_path.remove()
 
     @property
     def last_pulled_image_commit_sha1(self):
+        """The image cache key of the image last loaded by pull-image"""
         file_path = self.dir / 'pulled_image.sha1'
         if not file_path.exists():
             return None
@@ -55,9 +143,9 @@ class Work(object):
         file_path = self.dir / 'pulled_image.sha1'
         file_path.write_text(value)
 
-    def save_last_container_id_and_ip(self, container_id, container_ip):
-        (self.dir / 'last_container_id').write_text(container_id)
-        (self.dir / 'last_container_ip').write_text(container_ip)
+    def register_container(self, container_id, container_ip, **kwargs):
+        return self.registry.add(container_id=container_id, ip=container_ip,
+                                 **kwargs)
 
 
 work = Work()
@@ -35,6 +35,7 @@ setup(
         'path.py==8.1.2',
         'watchdog==0.8.3',
         'pyyaml==4.2b4',
+        'scandir==1.10.0',
         'FileServer==0.3'
     ],
     include_package_data=True,
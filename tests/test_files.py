@@ -0,0 +1,146 @@
+########
+# Copyright (c) 2016 GigaSpaces Technologies Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+############
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from docl import constants
+from docl import files
+
+CHUNK_SIZE = 64 * 1024
+FIXTURE = os.urandom(5 * CHUNK_SIZE + 123)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves FIXTURE, with range requests if the server's `ranges` is
+    set. A server's `fail_after` closes connections once that many bytes
+    were sent in total."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self._send_headers(len(FIXTURE))
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        if range_header and self.server.ranges:
+            start, end = (int(v) for v in re.match(
+                r'bytes=(\d+)-(\d+)', range_header).groups())
+            body = FIXTURE[start:end + 1]
+            self.send_response(206)
+        else:
+            body = FIXTURE
+            self.send_response(200)
+        self._send_headers(len(body))
+        for offset in range(0, len(body), 4096):
+            data = body[offset:offset + 4096]
+            with self.server.lock:
+                if self.server.fail_after is not None and \
+                        self.server.sent + len(data) > self.server.fail_after:
+                    return
+                self.server.sent += len(data)
+            self.wfile.write(data)
+
+    def _send_headers(self, size):
+        self.send_header('Content-Length', str(size))
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"fixture"')
+        self.end_headers()
+
+
+class DownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = constants.DOWNLOAD_CHUNK_SIZE
+        constants.DOWNLOAD_CHUNK_SIZE = CHUNK_SIZE
+        self.dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.dir, 'image')
+        self.servers = []
+
+    def tearDown(self):
+        constants.DOWNLOAD_CHUNK_SIZE = self.chunk_size
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.dir)
+
+    def _serve(self, ranges=True, fail_after=None):
+        server = _Server(('127.0.0.1', 0), _Handler)
+        server.ranges = ranges
+        server.fail_after = fail_after
+        server.sent = 0
+        server.lock = threading.Lock()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.servers.append(server)
+        return server, 'http://127.0.0.1:{}/image'.format(
+            server.server_address[1])
+
+    def _download(self, url):
+        files.download(url, self.output_path, no_progress=True,
+                       connections=4)
+
+    def _assert_downloaded(self):
+        with open(self.output_path, 'rb') as f:
+            self.assertEqual(FIXTURE, f.read())
+        self.assertFalse(os.path.exists(
+            '{}.download'.format(self.output_path)))
+
+    def test_ranged(self):
+        server, url = self._serve()
+        self._download(url)
+        self._assert_downloaded()
+        self.assertEqual(len(FIXTURE), server.sent)
+
+    def test_without_ranges(self):
+        server, url = self._serve(ranges=False)
+        self._download(url)
+        self._assert_downloaded()
+
+    def test_resume_interrupted(self):
+        server, url = self._serve(fail_after=2 * CHUNK_SIZE)
+        self.assertRaises(Exception, self._download, url)
+        self.assertTrue(os.path.exists(
+            '{}.download'.format(self.output_path)))
+        server.fail_after = None
+        server.sent = 0
+        self._download(url)
+        self._assert_downloaded()
+        # the part received before the interruption is not fetched again
+        self.assertLess(server.sent, len(FIXTURE))
+
+
+if __name__ == '__main__':
+    unittest.main()